@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks of the hot paths of a run, see benchmarks/run.py.
+"""
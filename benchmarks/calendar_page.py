@@ -0,0 +1,84 @@
+"""
+This module generates next-episode style calendar pages of a month for the benchmarks.
+
+The pages have the markup the calendar parsers read: the month select with the selected
+month and the year span next to it, and a day cell per day with a cal_name div (the link to
+the show) and a cal_more div (the air time) for every show of the day.
+"""
+
+import calendar
+import random
+
+# a show airs about three times a month, like the weekly shows of a real calendar
+EPISODES_PER_SHOW = 3
+
+
+def generate_month_page(
+    year: int,
+    month: int,
+    shows: int,
+    changed_fraction: float = 0.0,
+    seed: int = 0,
+    revision: int = 0,
+) -> str:
+    """
+    Generates the calendar page of a month.
+
+    Args:
+        year (int): The year of the page.
+        month (int): The month of the page.
+        shows (int): The number of shows airing in the month, spread over its days.
+        changed_fraction (float): The share of the shows which get another air time or are
+            replaced by another show, to generate the page of a later run.
+        seed (int): The seed of the generated shows, the same seed generates the same page.
+        revision (int): The seed of the changes, every revision changes other shows.
+
+    Returns:
+        str: The html of the page.
+    """
+    rnd = random.Random(seed * 1_000_003 + year * 100 + month)
+    changes = random.Random(seed * 7 + year * 100 + month + 1 + revision * 1_000_003)
+    days = calendar.monthrange(year, month)[1]
+    show_pool = max(1, shows // EPISODES_PER_SHOW)
+
+    entries_by_day: list[list[str]] = [[] for _ in range(days)]
+    for index in range(shows):
+        day = index * days // shows
+        show = rnd.randrange(show_pool)
+        hour = rnd.randrange(1, 13)
+        minute = rnd.choice((0, 15, 30, 45))
+        meridiem = rnd.choice(("am", "pm"))
+        season, episode = rnd.randrange(1, 10), rnd.randrange(1, 25)
+        if changes.random() < changed_fraction:
+            if changes.random() < 0.5:
+                hour = hour % 12 + 1
+            else:
+                show = show_pool + index
+        entries_by_day[day].append(
+            _show_entry(show, season, episode, f"{hour}:{minute:02d}{meridiem}")
+        )
+
+    options = "".join(
+        f"<option value='{i}'{' selected' if i == month else ''}>{calendar.month_name[i]}</option>"
+        for i in range(1, 13)
+    )
+    cells = "".join(
+        f"<td><div class='headerday'><span>{day}</span></div>{''.join(entries)}</td>{'</tr><tr>' if day % 7 == 0 else ''}"
+        for day, entries in enumerate(entries_by_day, start=1)
+    )
+    return (
+        "<html><head><title>TV Calendar</title></head><body>"
+        f"<form><select id='month' name='month'>{options}</select> <span>{year}</span></form>"
+        f"<table id='calendar'><tr>{cells}</tr></table>"
+        "</body></html>"
+    )
+
+
+def _show_entry(show: int, season: int, episode: int, time_str: str) -> str:
+    name = f"Generated Show {show}"
+    slug = f"generated-show-{show}"
+    return (
+        f"<div class='cal_name'><a href='//next-episode.net/{slug}' "
+        f"title='{name} - {season}x{episode:02d} - Episode {episode}'>{name}</a></div>"
+        f"<div class='cal_more'><div class='h'>{time_str}</div></div>"
+    )
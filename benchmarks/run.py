@@ -0,0 +1,304 @@
+"""
+Micro-benchmarks of the hot paths of a run on generated calendar pages.
+
+Every benchmark is timed on month pages of each size (the shows airing in the month), and
+its peak memory is measured with tracemalloc on a separate call. The results are written
+as JSON, to stdout or to the --output file, e.g.
+
+    python -m benchmarks.run --sizes 50,1000,20000 --output bench_output.json
+
+With a --baseline report the medians are compared to it, and the run exits with 1 when a
+benchmark got slower by more than the --threshold, e.g.
+
+    python -m benchmarks.run --baseline bench_output.json --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import copy
+import datetime
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+from benchmarks.calendar_page import generate_month_page
+from utility.calendar_parser import BS4_BACKEND, LXML_BACKEND, PARSER_BACKENDS
+from utility.event_filter_utility import (
+    diff_month_events,
+    return_new_list_of_series_which_actually_is_updated_v2,
+    return_no_longer_existing_event_v2,
+)
+from utility.filters_util import SeriesFilterEngine, filter_series
+from utility.general_util import fill_new_series_list_calendar_ids
+from utility.get_series_data import (
+    get_series_data_for_the_current_month_btw_start_date_end_date_v2,
+)
+from utility.time_utility import merge_time_str_datetime_date
+
+DEFAULT_SIZES = (50, 500, 5_000, 20_000)
+DEFAULT_REPEAT = 5
+# the share a median may be slower than the baseline's before it counts as a regression
+DEFAULT_THRESHOLD = 0.2
+# the share of the shows which differ between the old and the new page of a month
+CHANGED_FRACTION = 0.1
+YEAR, MONTH = 2030, 1
+# return_new_list_of_series_which_actually_is_updated_v2 is quadratic in the shows
+QUADRATIC_MAX_SHOWS = 5_000
+
+
+class MonthData:
+    """
+    The old and the new page of a month of the given size, and what the run makes of them.
+    """
+
+    def __init__(self, shows: int):
+        self.shows = shows
+        self.old_page = generate_month_page(YEAR, MONTH, shows)
+        self.new_page = generate_month_page(
+            YEAR, MONTH, shows, changed_fraction=CHANGED_FRACTION
+        )
+        self.old_events = _parse(self.old_page)
+        self.new_events = _parse(self.new_page)
+        for index, event in enumerate(self.old_events):
+            event.calendar_id = f"event{index}"
+        self.titles = [event.summary for event in self.new_events]
+
+    def copy_new_events(self):
+        """Returns a copy of the new events, for the benchmarks which change them."""
+        return copy.deepcopy(self.new_events)
+
+
+def _parse(page: str, parser_backend: str | None = None):
+    return get_series_data_for_the_current_month_btw_start_date_end_date_v2(
+        page, 1, 31, MONTH, YEAR, parser_backend
+    )
+
+
+def _filter_series_cold(titles: list[str]):
+    # a new engine per call, without the memoized titles of the previous calls
+    engine = SeriesFilterEngine.from_file()
+    for title in titles:
+        engine.is_filtered(title)
+
+
+def _sort_by_merge_time(events):
+    return sorted(
+        events,
+        key=lambda x: (merge_time_str_datetime_date(x.start_time, x.start_date), x.summary),
+    )
+
+
+def get_benchmarks() -> dict[str, tuple[Callable[[MonthData], Callable], int | None]]:
+    """
+    Returns the benchmarks by name, as (setup, max_shows). The setup takes the month data
+    and returns the function to time; sizes above max_shows are skipped. A benchmark which
+    changes its input returns (prepare, function) instead, prepare runs untimed before every
+    call and its result is passed to the function.
+    """
+    benchmarks = {
+        f"parse_v2[{backend}]": (
+            lambda data, backend=backend: lambda: _parse(data.new_page, backend),
+            None,
+        )
+        for backend in (BS4_BACKEND, LXML_BACKEND)
+        if backend in PARSER_BACKENDS
+    }
+    benchmarks.update(
+        {
+            "filter_series": (
+                lambda data: lambda: [filter_series(title) for title in data.titles],
+                None,
+            ),
+            "filter_series[cold]": (
+                lambda data: lambda: _filter_series_cold(data.titles),
+                None,
+            ),
+            "sort_by_merge_time_str_datetime_date": (
+                lambda data: lambda: _sort_by_merge_time(data.new_events),
+                None,
+            ),
+            "return_no_longer_existing_event_v2": (
+                lambda data: lambda: return_no_longer_existing_event_v2(
+                    data.old_events, data.new_events
+                ),
+                None,
+            ),
+            "return_new_list_of_series_which_actually_is_updated_v2": (
+                lambda data: lambda: return_new_list_of_series_which_actually_is_updated_v2(
+                    data.new_events, data.old_events
+                ),
+                QUADRATIC_MAX_SHOWS,
+            ),
+            # both copy the calendar ids of the old events onto the new ones
+            "diff_month_events": (
+                lambda data: (
+                    data.copy_new_events,
+                    lambda new_events: diff_month_events(data.old_events, new_events),
+                ),
+                None,
+            ),
+            "fill_new_series_list_calendar_ids": (
+                lambda data: (
+                    data.copy_new_events,
+                    lambda new_events: fill_new_series_list_calendar_ids(
+                        {"month": data.old_events}, "month", new_events
+                    ),
+                ),
+                None,
+            ),
+        }
+    )
+    return benchmarks
+
+
+def run_benchmark(
+    function: Callable, shows: int, repeat: int, prepare: Callable | None = None
+) -> dict:
+    """
+    Times the function repeat times and measures its peak memory on one more call.
+    With prepare, the function is called with a new result of prepare every time.
+    """
+    def call():
+        if prepare is None:
+            return function
+        argument = prepare()
+        return lambda: function(argument)
+
+    timings = []
+    for _ in range(repeat):
+        timed = call()
+        start_time = time.perf_counter()
+        timed()
+        timings.append(time.perf_counter() - start_time)
+
+    timed = call()
+    tracemalloc.start()
+    try:
+        timed()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        "median_seconds": median,
+        "min_seconds": min(timings),
+        "shows_per_second": shows / median if median else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def run(sizes: list[int], repeat: int, selected: list[str] | None = None) -> dict:
+    benchmarks = get_benchmarks()
+    results = []
+    for shows in sizes:
+        # the functions print, the JSON may go to stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = MonthData(shows)
+        for name, (setup, max_shows) in benchmarks.items():
+            if selected and name not in selected:
+                continue
+            result = {"benchmark": name, "shows": shows}
+            if max_shows is not None and shows > max_shows:
+                result["skipped"] = f"quadratic, only run up to {max_shows} shows"
+            else:
+                benchmark = setup(data)
+                prepare, function = (
+                    benchmark if isinstance(benchmark, tuple) else (None, benchmark)
+                )
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result.update(run_benchmark(function, shows, repeat, prepare))
+            results.append(result)
+            print(f"{name} [{shows} shows]: {result}", file=sys.stderr)
+
+    return {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "changed_fraction": CHANGED_FRACTION,
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compares the medians of the report to the baseline report.
+
+    Args:
+        report (dict): The report of this run.
+        baseline (dict): The report to compare to, e.g. of the previous commit.
+        threshold (float): The share a median may be slower than the baseline's.
+
+    Returns:
+        list[str]: The benchmarks which got slower by more than the threshold.
+    """
+    baseline_medians = {
+        (result["benchmark"], result["shows"]): result["median_seconds"]
+        for result in baseline.get("results", [])
+        if result.get("median_seconds")
+    }
+    regressions = []
+    for result in report["results"]:
+        key = (result["benchmark"], result["shows"])
+        if key not in baseline_medians or "median_seconds" not in result:
+            continue
+        ratio = result["median_seconds"] / baseline_medians[key]
+        print(f"{key[0]} [{key[1]} shows]: {ratio:.2f}x the baseline", file=sys.stderr)
+        if ratio > 1 + threshold:
+            regressions.append(f"{key[0]} [{key[1]} shows] is {ratio:.2f}x slower")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma separated shows per month, e.g. 50,500,20000",
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        help="only run this benchmark, can be given more than once",
+    )
+    parser.add_argument("--output", help="the JSON file, stdout if not given")
+    parser.add_argument("--baseline", help="a previous JSON report to compare the medians to")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="the share a median may be slower than the baseline's, e.g. 0.2",
+    )
+    args = parser.parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    report = run(
+        [int(size) for size in args.sizes.split(",")], args.repeat, args.benchmark
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if baseline is None:
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+A long-running entry point which keeps the logged-in client, the state and the calendar
+client warm in memory and refreshes the calendar on an internal schedule.
+
+The refresh interval is read from daemon_interval (seconds, one hour by default).
+SIGTERM and SIGINT stop the daemon once the refresh in progress is done.
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+
+from decorator_utils import lock_manager_decorator
+
+from main import (
+    LOCK_FILE,
+    METRICS_FILE,
+    TRACE_FILE,
+    SeriesServices,
+    close_services,
+    create_services,
+    refresh,
+    revalidate_session,
+    state_directories,
+)
+from utility import tracing
+
+DAEMON_INTERVAL = float(os.getenv("daemon_interval", "3600"))
+
+_stop = threading.Event()
+
+
+def _request_stop(signum, frame):
+    logging.info("Received signal %d, stopping after the current refresh", signum)
+    _stop.set()
+
+
+@lock_manager_decorator(LOCK_FILE)
+def serve(interval: float = DAEMON_INTERVAL):
+    """
+    Refreshes the calendar every interval seconds until SIGTERM or SIGINT is received.
+    The refreshes are scheduled from their start, a refresh which overruns the interval
+    is followed by the next one right away.
+
+    Args:
+        interval (float): The seconds between the start of two refreshes.
+    """
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    services: SeriesServices | None = None
+    with state_directories():
+        try:
+            while not _stop.is_set():
+                start_time = time.time()
+                try:
+                    with tracing.span("refresh"):
+                        if services is None:
+                            services = create_services()
+                        else:
+                            # the session may have expired since the last refresh
+                            revalidate_session(services)
+                        refresh(services)
+                    logging.info("Refresh finished in %.2f secs", time.time() - start_time)
+                except Exception:
+                    logging.exception("Refresh failed, the services are created again")
+                    # the in-memory state may be ahead of the store after a failed refresh
+                    if services is not None:
+                        close_services(services)
+                        services = None
+                finally:
+                    # every refresh replaces the trace and the metrics of the previous one
+                    tracing.get_tracer().export(TRACE_FILE, METRICS_FILE)
+                _stop.wait(max(0.0, interval - (time.time() - start_time)))
+        finally:
+            if services is not None:
+                close_services(services)
+            logging.info("Daemon stopped")
+
+
+if __name__ == "__main__":
+
+    serve()
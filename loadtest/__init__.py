@@ -0,0 +1,4 @@
+"""
+Local stand-ins of next-episode and the Google Calendar events API, and the end-to-end
+load test which runs main.py against them, see loadtest/run.py.
+"""
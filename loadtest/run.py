@@ -0,0 +1,255 @@
+"""
+End-to-end load test of main.py against the local stand-ins of next-episode and Google Calendar.
+
+The code of the repo is copied into a scratch directory, so the runs start from an empty
+data/ and images/ and never touch the real ones, and main.py is run there a number of times
+with the next-episode urls and the calendar redirected to the stand-ins. The calendar changes
+between the runs. The report has the seconds, the events written per second, the API calls
+and the tail latency of every run, as JSON to stdout or to the --output file, e.g.
+
+    python -m loadtest.run --shows 2000 --runs 3 --latency 0.05 --error-rate 0.01
+"""
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest.servers import (
+    DEFAULT_CHANGED_FRACTION,
+    DEFAULT_SHOWS_PER_MONTH,
+    FakeGoogleCalendarServer,
+    SESSION_COOKIE,
+    FakeNextEpisodeServer,
+    ServerSettings,
+)
+
+ROOT = Path(__file__).parent.parent
+# what main.py needs to run, with empty state directories
+SOURCES = ("main.py", "utility", "log", "series_filters.json")
+STATE_DIRECTORIES = ("data", "images")
+# settings of the environment which would send a run elsewhere
+OVERRIDDEN_SETTINGS = (
+    "http_mode",
+    "http_fixtures",
+    "http_replay_latency",
+    "next_session_check_url",
+)
+CALENDAR_WRITES = ("insert", "update", "delete")
+
+
+def prepare_workdir(workdir: Path):
+    """
+    Copies the code of the repo into the workdir, without its state and logs.
+    """
+    for name in STATE_DIRECTORIES:
+        workdir.joinpath(name).mkdir()
+    for name in SOURCES:
+        source = ROOT.joinpath(name)
+        if source.is_dir():
+            shutil.copytree(
+                source,
+                workdir.joinpath(name),
+                ignore=shutil.ignore_patterns("__pycache__", "*.log"),
+            )
+        else:
+            shutil.copy2(source, workdir.joinpath(name))
+
+
+def get_run_environment(
+    next_episode: FakeNextEpisodeServer,
+    google_calendar: FakeGoogleCalendarServer,
+    args: argparse.Namespace,
+) -> dict[str, str]:
+    env = {
+        key: value for key, value in os.environ.items() if key not in OVERRIDDEN_SETTINGS
+    }
+    env.update(
+        {
+            "next_episode_url": next_episode.url,
+            "next_login_url": f"{next_episode.url}/userlogin",
+            "next_session_cookie": SESSION_COOKIE,
+            "next_user": "loadtest",
+            "next_password": "loadtest",
+            "google_calendar_url": google_calendar.url,
+            "calendar_requests_per_second": str(args.calendar_rps),
+            "calendar_workers": str(args.calendar_workers),
+            "refresh_full_sweep": "1" if args.full_sweep else "0",
+        }
+    )
+    return env
+
+
+def run_once(
+    index: int,
+    workdir: Path,
+    env: dict[str, str],
+    next_episode: FakeNextEpisodeServer,
+    google_calendar: FakeGoogleCalendarServer,
+) -> dict:
+    """
+    Runs main.py once and returns what the stand-ins saw of it.
+    """
+    next_episode.reset_stats()
+    google_calendar.reset_stats()
+    output_file = workdir.joinpath(f"run{index}.out")
+    start_time = time.perf_counter()
+    with open(output_file, "w") as output:
+        process = subprocess.run(
+            [sys.executable, "main.py"],
+            cwd=workdir,
+            env=env,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        )
+    seconds = time.perf_counter() - start_time
+
+    calendar_stats = google_calendar.stats()
+    written = sum(
+        calendar_stats["requests"].get(name, 0) - calendar_stats["errors"].get(name, 0)
+        for name in CALENDAR_WRITES
+    )
+    next_episode_stats = next_episode.stats()
+    result = {
+        "run": index,
+        "exit_code": process.returncode,
+        "seconds": seconds,
+        "events_written": written,
+        "events_per_second": written / seconds if seconds else None,
+        "calendar_events": len(google_calendar.events),
+        "api_calls": {
+            "next_episode": sum(next_episode_stats["requests"].values()),
+            "google_calendar": sum(calendar_stats["requests"].values()),
+        },
+        "next_episode": next_episode_stats,
+        "google_calendar": calendar_stats,
+    }
+    if process.returncode:
+        result["output"] = output_file.read_text()[-2000:]
+    return result
+
+
+def run(args: argparse.Namespace) -> dict:
+    next_episode = FakeNextEpisodeServer(
+        args.shows,
+        args.changed_fraction,
+        ServerSettings(args.latency, args.latency_jitter, args.error_rate, args.seed),
+    )
+    google_calendar = FakeGoogleCalendarServer(
+        ServerSettings(
+            args.calendar_latency,
+            args.latency_jitter,
+            args.calendar_error_rate,
+            args.seed + 1,
+        )
+    )
+    workdir = Path(tempfile.mkdtemp(prefix="series-loadtest-"))
+    results = []
+    try:
+        prepare_workdir(workdir)
+        with next_episode, google_calendar:
+            env = get_run_environment(next_episode, google_calendar, args)
+            for index in range(args.runs):
+                if index:
+                    next_episode.advance()
+                result = run_once(index, workdir, env, next_episode, google_calendar)
+                results.append(result)
+                print(
+                    f"run {index}: {result['seconds']:.2f} secs, "
+                    f"{result['events_written']} events written, "
+                    f"exit code {result['exit_code']}",
+                    file=sys.stderr,
+                )
+    finally:
+        if args.keep_workdir:
+            print(f"The runs are kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "runs": results,
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--shows",
+        type=int,
+        default=DEFAULT_SHOWS_PER_MONTH,
+        help="shows airing in every month of the calendar",
+    )
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument(
+        "--changed-fraction",
+        type=float,
+        default=DEFAULT_CHANGED_FRACTION,
+        help="share of the shows of a month which change between the runs",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added by next-episode"
+    )
+    parser.add_argument(
+        "--calendar-latency",
+        type=float,
+        default=0.0,
+        help="seconds added by the calendar API",
+    )
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.0,
+        help="up to this many random seconds more on every response",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of the next-episode requests answered with a 503",
+    )
+    parser.add_argument(
+        "--calendar-error-rate",
+        type=float,
+        default=0.0,
+        help="share of the calendar requests answered with a 429",
+    )
+    parser.add_argument(
+        "--calendar-rps",
+        type=float,
+        default=1000.0,
+        help="the calendar_requests_per_second of the runs",
+    )
+    parser.add_argument("--calendar-workers", type=int, default=1)
+    parser.add_argument(
+        "--full-sweep",
+        action="store_true",
+        help="fetch every month on every run instead of the ones which are due",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", help="the JSON file, stdout if not given")
+    args = parser.parse_args(argv)
+
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
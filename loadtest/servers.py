@@ -0,0 +1,378 @@
+"""
+This module contains local stand-ins of next-episode and of the Google Calendar events API.
+
+Both are threaded HTTP servers on a free local port. Every response can be delayed by a
+fixed latency plus a random jitter, and a share of the requests is answered with an error:
+a 503 by next-episode and a 429 rateLimitExceeded by the calendar, which the run retries.
+The servers count the requests and the errors per endpoint and keep the time every request
+took to answer.
+
+The next-episode stand-in serves the login, the session check, the generated calendar pages
+(with an ETag, to a logged-in session only), the show pages and the posters. The pages of a month change by the
+changed_fraction of its shows whenever the revision is advanced, i.e. between runs.
+"""
+
+from collections import Counter
+import dataclasses
+import hashlib
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+from benchmarks.calendar_page import generate_month_page
+
+# status, headers, body
+Response = tuple[int, dict[str, str], bytes]
+
+DEFAULT_SHOWS_PER_MONTH = 500
+DEFAULT_CHANGED_FRACTION = 0.1
+DEFAULT_POSTER_SIZE = 16 * 1024
+SESSION_COOKIE = "PHPSESSID"
+
+
+@dataclasses.dataclass
+class ServerSettings:
+    """
+    The latency and the errors of a stand-in.
+    """
+
+    # seconds added to every response
+    latency: float = 0.0
+    # up to this many seconds more, uniformly distributed
+    latency_jitter: float = 0.0
+    # share of the requests answered with an error
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+class StandInServer:
+    """
+    A threaded HTTP server on a free local port with the latency, the errors and the counters
+    of a stand-in. Subclasses name the endpoint of a request and answer it.
+    """
+
+    error_status = 503
+
+    def __init__(self, settings: ServerSettings | None = None):
+        self.settings = settings or ServerSettings()
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+        self.reset_stats()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests: Counter[str] = Counter()
+            self.errors: Counter[str] = Counter()
+            self.latencies: list[float] = []
+
+    def stats(self) -> dict:
+        """
+        Returns the requests and the injected errors per endpoint, and the percentiles of
+        the seconds the requests took to answer.
+        """
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "errors": dict(self.errors),
+                "latency": latency_percentiles(self.latencies),
+            }
+
+    def endpoint(self, method: str, path: str) -> str:
+        raise NotImplementedError
+
+    def handle(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> Response:
+        raise NotImplementedError
+
+    def error_response(self) -> Response:
+        return self.error_status, {}, b""
+
+    def dispatch(self, method: str, target: str, headers, body: bytes) -> Response:
+        start_time = time.perf_counter()
+        parts = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        endpoint = self.endpoint(method, parts.path)
+        with self._lock:
+            self.requests[endpoint] += 1
+            delay = self.settings.latency + self._random.uniform(
+                0, self.settings.latency_jitter
+            )
+            failed = self._random.random() < self.settings.error_rate
+        if delay:
+            time.sleep(delay)
+
+        if failed:
+            response = self.error_response()
+            with self._lock:
+                self.errors[endpoint] += 1
+        else:
+            response = self.handle(method, parts.path, query, headers, body)
+
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start_time)
+        return response
+
+
+class FakeNextEpisodeServer(StandInServer):
+    """
+    The login, the calendar, the show pages and the posters of next-episode.
+    """
+
+    def __init__(
+        self,
+        shows_per_month: int = DEFAULT_SHOWS_PER_MONTH,
+        changed_fraction: float = DEFAULT_CHANGED_FRACTION,
+        settings: ServerSettings | None = None,
+        poster_size: int = DEFAULT_POSTER_SIZE,
+    ):
+        """
+        Args:
+            shows_per_month (int): The shows airing in every month of the calendar.
+            changed_fraction (float): The share of the shows of a month which change with
+                every revision.
+            settings (ServerSettings | None): The latency and the errors.
+            poster_size (int): The bytes of every poster.
+        """
+        super().__init__(settings)
+        self.shows_per_month = shows_per_month
+        self.changed_fraction = changed_fraction
+        self.poster_size = poster_size
+        self.revision = 0
+        self._sessions: set[str] = set()
+        self._pages: dict[tuple[int, int, int], tuple[bytes, str]] = {}
+
+    def advance(self):
+        """
+        Changes the calendar, the next run sees the changed_fraction of every month changed.
+        """
+        with self._lock:
+            self.revision += 1
+            self._pages.clear()
+
+    def endpoint(self, method: str, path: str) -> str:
+        if path == "/userlogin":
+            return "login"
+        if path == "/":
+            return "session_check"
+        if path.startswith("/calendar"):
+            return "calendar"
+        if path.startswith("/img/"):
+            return "poster"
+        return "show"
+
+    def handle(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> Response:
+        endpoint = self.endpoint(method, path)
+        if endpoint == "login":
+            return self._login(method, body)
+        if endpoint == "session_check":
+            if self._has_session(headers):
+                return 200, {"Content-Type": "text/html"}, b"<html>Home</html>"
+            return 302, {"Location": "/userlogin"}, b""
+        if endpoint == "calendar":
+            if not self._has_session(headers):
+                return 302, {"Location": "/userlogin"}, b""
+            return self._calendar(query, headers)
+        if endpoint == "poster":
+            return self._poster(path)
+        slug = path.strip("/")
+        html = f"<html><body><img id='big_image' src='{self.url}/img/{slug}.jpg'></body></html>"
+        return 200, {"Content-Type": "text/html"}, html.encode()
+
+    def _login(self, method: str, body: bytes) -> Response:
+        if method != "POST":
+            return 200, {"Content-Type": "text/html"}, b"<html><form></form></html>"
+        form = parse_qs(body.decode())
+        if not form.get("username") or not form.get("password"):
+            return 401, {}, b""
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._sessions.add(token)
+        return (
+            302,
+            {
+                "Location": "/",
+                "Set-Cookie": f"{SESSION_COOKIE}={token}; Path=/; Max-Age=86400",
+            },
+            b"",
+        )
+
+    def _has_session(self, headers) -> bool:
+        cookie = SimpleCookie(headers.get("Cookie", ""))
+        token = cookie.get(SESSION_COOKIE)
+        with self._lock:
+            return token is not None and token.value in self._sessions
+
+    def _calendar(self, query: dict, headers) -> Response:
+        try:
+            year, month = int(query["year"]), int(query["month"])
+        except (KeyError, ValueError):
+            return 400, {}, b""
+        page, etag = self._get_page(year, month)
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"Content-Type": "text/html", "ETag": etag}, page
+
+    def _get_page(self, year: int, month: int) -> tuple[bytes, str]:
+        with self._lock:
+            revision = self.revision
+            page = self._pages.get((year, month, revision))
+        if page is not None:
+            return page
+        html = generate_month_page(
+            year,
+            month,
+            self.shows_per_month,
+            self.changed_fraction if revision else 0.0,
+            revision=revision,
+        ).encode()
+        page = html, f'"{hashlib.sha1(html).hexdigest()}"'
+        with self._lock:
+            self._pages[(year, month, revision)] = page
+        return page
+
+    def _poster(self, path: str) -> Response:
+        digest = hashlib.sha256(path.encode()).digest()
+        content = (digest * (self.poster_size // len(digest) + 1))[: self.poster_size]
+        return 200, {"Content-Type": "image/jpeg"}, content
+
+
+class FakeGoogleCalendarServer(StandInServer):
+    """
+    The events insert, update and delete of the Google Calendar API v3.
+    """
+
+    error_status = 429
+
+    def __init__(self, settings: ServerSettings | None = None):
+        super().__init__(settings)
+        self.events: dict[str, dict] = {}
+        self._ids = itertools.count(1)
+
+    def endpoint(self, method: str, path: str) -> str:
+        return {"POST": "insert", "PUT": "update", "DELETE": "delete"}.get(method, "get")
+
+    def error_response(self) -> Response:
+        error = {
+            "error": {
+                "code": 429,
+                "message": "Rate Limit Exceeded",
+                "errors": [{"reason": "rateLimitExceeded"}],
+            }
+        }
+        return 429, {"Content-Type": "application/json"}, json.dumps(error).encode()
+
+    def handle(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> Response:
+        # /calendars/{calendar_id}/events[/{event_id}]
+        segments = path.strip("/").split("/")
+        if len(segments) < 3 or segments[0] != "calendars" or segments[2] != "events":
+            return 404, {}, b""
+        event_id = segments[3] if len(segments) > 3 else None
+
+        with self._lock:
+            if method == "POST" and event_id is None:
+                event = {**json.loads(body), "id": f"event{next(self._ids)}"}
+                self.events[event["id"]] = event
+                return _json_response(event)
+            if event_id not in self.events:
+                return 404, {}, b""
+            if method == "PUT":
+                event = {**json.loads(body), "id": event_id}
+                self.events[event_id] = event
+                return _json_response(event)
+            if method == "DELETE":
+                del self.events[event_id]
+                return 204, {}, b""
+            if method == "GET":
+                return _json_response(self.events[event_id])
+        return 405, {}, b""
+
+
+def latency_percentiles(latencies: list[float]) -> dict:
+    """
+    Returns the count, the median, the 95th and 99th percentiles and the maximum of the latencies.
+    """
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50": _percentile(ordered, 0.5),
+        "p95": _percentile(ordered, 0.95),
+        "p99": _percentile(ordered, 0.99),
+        "max": ordered[-1],
+    }
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    # nearest rank
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def _json_response(data: dict) -> Response:
+    return 200, {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+def _make_handler(server: StandInServer) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # the headers and the body go out in separate writes, which would wait for delayed acks
+        disable_nagle_algorithm = True
+
+        def _dispatch(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, headers, content = server.dispatch(
+                self.command, self.path, self.headers, body
+            )
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if content and self.command != "HEAD":
+                self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
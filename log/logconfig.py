@@ -1,8 +1,12 @@
+import atexit
 import logging as log
 import pathlib
+import queue
 import sys
+import threading
+import time
 from common_util import DesktopNotification
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 logger_path = pathlib.Path(__file__).parent.joinpath("logger.log")
 
@@ -28,6 +32,50 @@ class ExcludeAESFilter(log.Filter):
         return True
 
 
+class RateLimitFilter(log.Filter):
+    """
+    Lets at most burst records of the same message (the same format string from the same line)
+    through per interval seconds. The next record let through tells how many were dropped.
+    Disabled while interval is 0.
+    """
+
+    def __init__(self, interval: float = 0.0, burst: int = 5):
+        super().__init__()
+        self._lock = threading.Lock()
+        # (pathname, lineno, msg) -> [window start, records in the window, suppressed]
+        self._windows: dict[tuple, list] = {}
+        self.configure(interval, burst)
+
+    def configure(self, interval: float, burst: int = 5):
+        """
+        Sets the interval in seconds (0 to disable) and the records let through per interval.
+        """
+        with self._lock:
+            self.interval = interval
+            self.burst = max(1, burst)
+            self._windows.clear()
+
+    def filter(self, record):
+        if not self.interval or record.levelno >= log.ERROR:
+            return True
+        key = (record.pathname, record.lineno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
 # Define a TimedRotatingFileHandler to rotate logs daily and keep only the last 5 days' logs
 handler = TimedRotatingFileHandler(
     filename=logger_path,
@@ -49,14 +97,24 @@ formatter.datefmt = "%m/%d/%Y %I:%M:%S %p"
 handler.setFormatter(formatter)
 handler.setLevel(log.INFO)
 
-# Add the handler to the logger
-logger.addHandler(handler)
-
 # Add a stream handler to output logs to stdout
 stream_handler = log.StreamHandler(sys.stdout)
 stream_handler.setLevel(log.INFO)
 stream_handler.setFormatter(formatter)
-logger.addHandler(stream_handler)
+
+# The logger only puts the records on a queue, a background thread writes them to the
+# file and to stdout, so the scrape threads and the event loop never wait on log I/O
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+# repetitive messages are dropped before they are queued, configured by the entry point
+rate_limit_filter = RateLimitFilter()
+queue_handler.addFilter(rate_limit_filter)
+logger.addHandler(queue_handler)
+
+listener = QueueListener(log_queue, handler, stream_handler, respect_handler_level=True)
+listener.start()
+# the records still on the queue are written before the process exits
+atexit.register(listener.stop)
 
 
 # Define the function to log uncaught exceptions
@@ -71,9 +129,10 @@ def log_uncaught_exceptions(exctype, value, traceback):
 
     if isinstance(value, KeyboardInterrupt):
         log.info("Keyboard Interrupt instance detected")
-        print(logger.handlers)
-        for loggers_handlers in logger.handlers:
+        log.debug("Removing the log handlers %s", logger.handlers)
+        for loggers_handlers in list(logger.handlers):
             logger.removeHandler(loggers_handlers)
+        listener.stop()
 
         return
 
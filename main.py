@@ -2,31 +2,60 @@
 A module for Adding Anime from next episode to google calendar.
 """
 
+import contextlib
 import logging
 import os
 import time
+from collections.abc import MutableMapping
+from dataclasses import dataclass
 from datetime import datetime
+import functools
 
 import dotenv
+import httpx
 from common_dto.events import CalendarDtoPickled
 
 # Move all import statements here
-from utility import time_utility
-from utility.general_util import get_anime_urls_from_events_v2
+from utility import time_utility, tracing
+from utility.filters_util import get_series_filter_engine
+from utility.calendar_api_client import CalendarApiClient
+from utility.calendar_session import CalendarSession
 from utility.google_calendar_util import (
     add_event_from_data_series_v2,
     delete_no_longer_existing_events_v2,
 )
-from utility.get_series_data import get_series_for_year, NO_LONGER_EXISTING_EVENTS
-from utility.login import login_user_httpx
+from utility.get_series_data import (
+    get_series_for_years,
+    set_next_episode_url,
+    NO_LONGER_EXISTING_EVENTS,
+)
+from utility.http_cache import CalendarPageCache
+from utility.http_fixtures import REPLAY, HttpFixtures, get_http_fixtures
+from utility.login import (
+    is_logged_in,
+    is_session_valid,
+    login_user_httpx,
+    save_session_cookies,
+)
+from utility.orchestrator import DEFAULT_QUEUE_SIZE, MonthPipeline
+from utility.refresh_scheduler import MonthRefreshScheduler
+from utility.rate_limiter import AdaptiveTokenBucket, DEFAULT_REQUESTS_PER_SECOND
 from utility.pickle_utility import (
-    get_picked_series_data,
-    save_picked_series_data,
+    DATA_DIRECTORY,
+    clean_old_data,
+    scratch_state_directories,
+)
+from utility.state_store import SeriesStateStore
+from utility.get_image_from_url import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_POSTER_URL_TTL,
+    ImageDownloadService,
 )
-from utility.get_image_from_url import download_image_from_urls
+from utility.image_cache import DEFAULT_MAX_BYTES, DEFAULT_MAX_FILES, ImageCacheManager
 from utility.series_to_image_mapping import SeriesToImageMapping
 from decorator_utils import lock_manager_decorator
-from log.logconfig import logger  # noqa: F401
+from gdrive_tool.my_google_calendar import GoogleCalendar
+from log.logconfig import logger, rate_limit_filter  # noqa: F401
 
 dotenv.load_dotenv()
 
@@ -34,61 +63,277 @@ dotenv.load_dotenv()
 LOGIN_URL = os.getenv("next_login_url", "")
 USERNAME = os.getenv("next_user", "")
 PASSWORD = os.getenv("next_password", "")
+# a page which redirects to the login when the session isn't valid anymore, the daemon
+# checks it before every refresh
+SESSION_CHECK_URL = os.getenv("next_session_check_url") or None
+# the name of the session cookie of the site, any of its cookies when not set
+SESSION_COOKIE = os.getenv("next_session_cookie") or None
+FETCH_CONCURRENCY = int(os.getenv("next_fetch_concurrency", "4"))
+PARSER_BACKEND = os.getenv("next_parser_backend") or None
+# writes and deletes the calendar events in batch requests of this size when set
+CALENDAR_BATCH_SIZE = int(os.getenv("calendar_batch_size", "0")) or None
+CALENDAR_WORKERS = int(os.getenv("calendar_workers", "1"))
+CALENDAR_REQUESTS_PER_SECOND = float(
+    os.getenv("calendar_requests_per_second", str(DEFAULT_REQUESTS_PER_SECOND))
+)
+IMAGE_DOWNLOAD_CONCURRENCY = int(
+    os.getenv("image_download_concurrency", str(DEFAULT_MAX_CONCURRENCY))
+)
+POSTER_URL_TTL = float(os.getenv("poster_url_ttl", str(DEFAULT_POSTER_URL_TTL)))
+PIPELINE_QUEUE_SIZE = int(os.getenv("pipeline_queue_size", str(DEFAULT_QUEUE_SIZE)))
+# fetches every month on this run instead of the ones which are due
+REFRESH_FULL_SWEEP = os.getenv("refresh_full_sweep", "0") == "1"
+# the budgets of images/, unlimited when 0
+IMAGE_CACHE_MAX_BYTES = (
+    int(os.getenv("image_cache_max_bytes", str(DEFAULT_MAX_BYTES))) or None
+)
+IMAGE_CACHE_MAX_FILES = (
+    int(os.getenv("image_cache_max_files", str(DEFAULT_MAX_FILES))) or None
+)
+# "record" captures every exchange of the run into the fixtures, "replay" serves them back offline,
+# both on a scratch copy of data/ and images/ and without writing to the real calendar
+HTTP_MODE = os.getenv("http_mode") or None
+HTTP_FIXTURES = os.getenv("http_fixtures") or None
+# seconds added per host to the replayed exchanges, e.g. "next-episode.net=0.2,calendar=0.1"
+HTTP_REPLAY_LATENCY = os.getenv("http_replay_latency")
+# redirect the calendar pages and show links, and the calendar events, e.g. to the load test stand-ins
+NEXT_EPISODE_URL = os.getenv("next_episode_url") or None
+GOOGLE_CALENDAR_URL = os.getenv("google_calendar_url") or None
+# the spans of a run as a Chrome trace, and their totals as a Prometheus textfile, empty to skip
+# the runs of the http modes don't replace the ones of the real runs
+_RUN_SUFFIX = f".{HTTP_MODE}" if HTTP_MODE else ""
+TRACE_FILE = os.getenv("trace_file", str(DATA_DIRECTORY.joinpath(f"trace{_RUN_SUFFIX}.json")))
+METRICS_FILE = os.getenv(
+    "metrics_file", str(DATA_DIRECTORY.joinpath(f"series{_RUN_SUFFIX}.prom"))
+)
+# lets at most log_rate_limit_burst records of the same message through per
+# log_rate_limit_interval seconds, every message goes through when 0
+LOG_RATE_LIMIT_INTERVAL = float(os.getenv("log_rate_limit_interval", "0"))
+LOG_RATE_LIMIT_BURST = int(os.getenv("log_rate_limit_burst", "5"))
+rate_limit_filter.configure(LOG_RATE_LIMIT_INTERVAL, LOG_RATE_LIMIT_BURST)
 CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCK_FILE = os.path.join(CUR_DIR, "series.lock")
 
 
-@lock_manager_decorator(os.path.join(CUR_DIR, "series.lock"))
-def main():
-    """Main function to execute the script for adding anime events to Google Calendar."""
+@dataclass
+class SeriesServices:
+    """
+    The logged-in client, the state and the clients which a refresh works with.
+    The one-shot script creates them for a single refresh, the daemon keeps them warm.
+    """
 
-    start_time = time.time()
-    s = login_user_httpx(USERNAME, PASSWORD, LOGIN_URL)
+    session: httpx.Client
+    state_store: SeriesStateStore
+    series_old_data: MutableMapping[str, list[CalendarDtoPickled]]
+    day_fingerprints: MutableMapping[str, dict[int, str]]
+    images_mapping: SeriesToImageMapping
+    page_cache: CalendarPageCache
+    refresh_scheduler: MonthRefreshScheduler
+    calendar_session: CalendarSession
+    image_downloader: ImageDownloadService
+    http_fixtures: HttpFixtures | None = None
+
+
+def create_services() -> SeriesServices:
+    """Logs in and creates the state and the clients of the refreshes."""
+    http_fixtures = get_http_fixtures(HTTP_MODE, HTTP_FIXTURES, HTTP_REPLAY_LATENCY)
+    if NEXT_EPISODE_URL:
+        set_next_episode_url(NEXT_EPISODE_URL)
+    calendar_client_factory = GoogleCalendar
+    if GOOGLE_CALENDAR_URL:
+        calendar_client_factory = functools.partial(
+            CalendarApiClient, GOOGLE_CALENDAR_URL
+        )
+    if http_fixtures is not None:
+        calendar_client_factory = http_fixtures.calendar_client
+
+    s = login(http_fixtures)
 
     # return
     # clean_up()
-    series_old_data: dict[str, list[CalendarDtoPickled]] = get_picked_series_data()
+    # the store and the mapping are kept by the process, the daemon builds the services
+    # again after a failed refresh, which mustn't carry over what it didn't save
+    state_store = SeriesStateStore()
+    state_store.rollback()
+    images_mapping = SeriesToImageMapping()
+    images_mapping.reload()
+    series_filter_engine = get_series_filter_engine()
+    return SeriesServices(
+        session=s,
+        state_store=state_store,
+        # months are loaded from the store the first time they're accessed
+        series_old_data=state_store.load_series_data(),
+        day_fingerprints=state_store.load_day_fingerprints(),
+        images_mapping=images_mapping,
+        page_cache=CalendarPageCache(signature=series_filter_engine.signature),
+        refresh_scheduler=MonthRefreshScheduler(full_sweep=REFRESH_FULL_SWEEP),
+        calendar_session=CalendarSession(
+            client_factory=calendar_client_factory,
+            max_workers=CALENDAR_WORKERS,
+            rate_limiter=AdaptiveTokenBucket(CALENDAR_REQUESTS_PER_SECOND),
+        ),
+        # one client and one event loop for the images of the whole run
+        image_downloader=ImageDownloadService(
+            IMAGE_DOWNLOAD_CONCURRENCY,
+            poster_url_ttl=POSTER_URL_TTL,
+            transport=http_fixtures.async_transport() if http_fixtures else None,
+        ),
+        http_fixtures=http_fixtures,
+    )
 
-    print("Getting series for the year")
 
-    current_year = time_utility.get_current_year()
-    current_month = datetime.now().month
+def login(http_fixtures: HttpFixtures | None = None) -> httpx.Client:
+    """Logs in to next-episode."""
+    # the saved session is reused, the client logs in when the site sends it to the login
+    with tracing.span("login"):
+        return login_user_httpx(
+            USERNAME,
+            PASSWORD,
+            LOGIN_URL,
+            transport=http_fixtures.transport() if http_fixtures else None,
+            session_cookie=SESSION_COOKIE,
+        )
 
-    images_mapping = SeriesToImageMapping()
 
-    # Get series for the current year
-    for data in get_series_for_year(s, current_year, series_old_data):
-        anime_url = get_anime_urls_from_events_v2(data)
+def revalidate_session(services: SeriesServices):
+    """Logs in again when the session expired, e.g. between the refreshes of the daemon."""
+    with tracing.span("session_check"):
+        valid = is_session_valid(
+            services.session, LOGIN_URL, SESSION_CHECK_URL, SESSION_COOKIE
+        )
+    if valid:
+        return
+    logging.warning("The next-episode session isn't valid anymore, logging in again")
+    services.session.close()
+    services.session = login(services.http_fixtures)
 
-        download_image_from_urls(anime_url)
 
-        add_event_from_data_series_v2(data, images_mapping.get_mapping())
+def refresh(services: SeriesServices):
+    """Fetches the calendar, writes the new events, deletes the removed ones and saves the state."""
+    # the events to delete and the counters are per refresh
+    NO_LONGER_EXISTING_EVENTS.clear()
+    _reset_stats(services)
+    series_old_data = services.series_old_data
+    images_mapping = services.images_mapping
+    calendar_session = services.calendar_session
+    image_downloader = services.image_downloader
+    page_cache = services.page_cache
+
+    logging.info("Getting series for the current and the next year")
+
+    current_year = time_utility.get_current_year()
+    current_month = datetime.now().month
 
     month_limiter = -7 + current_month
     next_year = current_year + 1
-    print("Getting series for the next year")
-    for data in get_series_for_year(
-        s, next_year, series_old_data, month_limiter
-    ):  # till the month limiter
-
-        anime_url = get_anime_urls_from_events_v2(data)
 
-        download_image_from_urls(anime_url)
+    def write_events(data: list[CalendarDtoPickled]):
+        add_event_from_data_series_v2(
+            data, images_mapping.get_mapping(), CALENDAR_BATCH_SIZE, calendar_session
+        )
 
-        add_event_from_data_series_v2(data, images_mapping.get_mapping())
+    # the current year and the next year (till the month limiter) are fetched together,
+    # a month's posters download while the next month is fetched and the previous one written
+    MonthPipeline(image_downloader, write_events, PIPELINE_QUEUE_SIZE).run(
+        get_series_for_years(
+            services.session,
+            [(current_year, 12), (next_year, month_limiter)],
+            series_old_data,
+            FETCH_CONCURRENCY,
+            PARSER_BACKEND,
+            page_cache,
+            services.day_fingerprints,
+            services.refresh_scheduler,
+        )
+    )
 
-    save_picked_series_data(series_old_data)
+    clean_old_data(series_old_data)
+    # urls which aren't in any month anymore, their image mappings are removed on save
+    stale_urls = services.state_store.save(series_old_data, services.day_fingerprints)
+    services.refresh_scheduler.save()
+    page_cache.save()
+    logging.info("Month refresh: %s", services.refresh_scheduler.stats())
+    logging.info("Calendar page cache: %s", page_cache.stats())
+    logging.info("Series filter: %s", get_series_filter_engine().stats())
 
     if NO_LONGER_EXISTING_EVENTS:
         logging.info(
             "No longer existing events size: %d", len(NO_LONGER_EXISTING_EVENTS)
         )
-        delete_no_longer_existing_events_v2(
-            NO_LONGER_EXISTING_EVENTS, images_mapping.get_mapping()
-        )
+        with tracing.span("delete_events", events=len(NO_LONGER_EXISTING_EVENTS)):
+            delete_no_longer_existing_events_v2(
+                NO_LONGER_EXISTING_EVENTS,
+                images_mapping.get_mapping(),
+                CALENDAR_BATCH_SIZE,
+                calendar_session,
+            )
     else:
         logging.info("No events to delete.")
 
-    images_mapping.save_mapping()
+    # the background revalidations may still change the mapping
+    image_downloader.flush()
+    logging.info("Image downloads: %s", image_downloader.stats())
+    logging.info("Image store: %s", image_downloader.image_store.stats())
+    # orphaned images are swept and the least recently aired ones evicted once the run is done
+    image_cache = ImageCacheManager(
+        max_bytes=IMAGE_CACHE_MAX_BYTES, max_files=IMAGE_CACHE_MAX_FILES
+    )
+    evicted_urls = image_cache.collect(
+        images_mapping.get_mapping(),
+        stale_urls,
+        sweep_orphans=not images_mapping.load_failed,
+    )
+    images_mapping.save_mapping(stale_urls | evicted_urls)
+    logging.info("Calendar session: %s", calendar_session.stats())
+
+
+def _reset_stats(services: SeriesServices):
+    services.refresh_scheduler.reset_stats()
+    services.page_cache.reset_stats()
+    get_series_filter_engine().reset_stats()
+    services.image_downloader.reset_stats()
+    services.image_downloader.image_store.reset_stats()
+    services.calendar_session.reset_stats()
+
+
+def close_services(services: SeriesServices):
+    """Closes the clients and the worker threads of the services."""
+    services.image_downloader.close()
+    services.calendar_session.close()
+    # the cookies the site refreshed during the run are kept for the next one, the
+    # cookies of a failed login would be reused as a logged-out session and the
+    # replayed ones aren't a session of the site
+    replaying = services.http_fixtures is not None and services.http_fixtures.mode == REPLAY
+    if is_logged_in(services.session) and not replaying:
+        save_session_cookies(services.session)
+    services.session.close()
+    if services.http_fixtures is not None:
+        services.http_fixtures.save()
+
+
+@lock_manager_decorator(LOCK_FILE)
+def state_directories() -> contextlib.AbstractContextManager:
+    """Returns the context the state is used in, a scratch copy of it in the http modes."""
+    if HTTP_MODE:
+        return scratch_state_directories(HTTP_MODE)
+    return contextlib.nullcontext()
+
+
+def main():
+    """Main function to execute the script for adding anime events to Google Calendar."""
+
+    start_time = time.time()
+    try:
+        with state_directories(), tracing.span("run"):
+            services = create_services()
+            try:
+                with tracing.span("refresh"):
+                    refresh(services)
+            finally:
+                close_services(services)
+    finally:
+        # a failed run is exported too, its spans carry the error
+        tracing.get_tracer().export(TRACE_FILE, METRICS_FILE)
 
     logging.info("Finished the script in %.2f secs", time.time() - start_time)
 
@@ -0,0 +1,94 @@
+"""
+This module contains a calendar client for a Google Calendar events API at another base url.
+
+The client has the create_event_v2 and delete_event methods of the GoogleCalendar client which
+a run calls, and sends them as the events insert, update and delete requests of the Calendar
+API v3 to the base url, e.g. to the local stand-in of the load test. It doesn't expose a
+service, so the batch mode writes its events one by one.
+"""
+
+import datetime
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALENDAR_ID = "primary"
+
+
+class CalendarApiClient:
+    """
+    Writes and deletes the events of a calendar through the events API at base_url.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        calendar_id: str = DEFAULT_CALENDAR_ID,
+        timeout: float = 10.0,
+        transport: httpx.BaseTransport | None = None,
+    ):
+        """
+        Args:
+            base_url (str): The root of the API, the events are under
+                {base_url}/calendars/{calendar_id}/events.
+            calendar_id (str): The calendar the events are written to.
+            timeout (float): The timeout of every request in seconds.
+            transport (httpx.BaseTransport | None): The transport of the client.
+        """
+        self._events_url = f"/calendars/{calendar_id}/events"
+        self._client = httpx.Client(
+            base_url=base_url.rstrip("/"), timeout=timeout, transport=transport
+        )
+
+    def create_event_v2(
+        self,
+        summary: str,
+        description: str,
+        image_url: str | None,
+        start_time: datetime.datetime,
+        end_time: datetime.datetime,
+        time_zone: str,
+        event_id: str | None = None,
+    ) -> str | None:
+        """
+        Inserts the event, or updates it if it has an event_id which still exists.
+
+        Returns:
+            str | None: The id of the event.
+        """
+        body = {
+            "summary": summary,
+            "description": description,
+            "start": {"dateTime": start_time.isoformat(), "timeZone": time_zone},
+            "end": {"dateTime": end_time.isoformat(), "timeZone": time_zone},
+        }
+        if image_url:
+            body["extendedProperties"] = {"private": {"image": str(image_url)}}
+
+        if event_id:
+            response = self._client.put(f"{self._events_url}/{event_id}", json=body)
+            if response.status_code != 404:
+                response.raise_for_status()
+                return response.json().get("id")
+            logger.debug("Event %s of %s doesn't exist anymore, inserting it", event_id, summary)
+
+        response = self._client.post(self._events_url, json=body)
+        response.raise_for_status()
+        return response.json().get("id")
+
+    def delete_event(
+        self, event_id: str, image_url: str | None = None, summary: str | None = None
+    ):
+        """
+        Deletes the event, an event which is already gone is skipped.
+        """
+        response = self._client.delete(f"{self._events_url}/{event_id}")
+        if response.status_code in (404, 410):
+            logger.debug("Event %s of %s was already deleted", event_id, summary)
+            return
+        response.raise_for_status()
+
+    def close(self):
+        self._client.close()
@@ -0,0 +1,187 @@
+"""
+This module contains the batch mode of the Google Calendar writes and deletes.
+
+The operations are grouped into Google Calendar batch requests of a configurable size, built
+on the googleapiclient service of the calendar client. Every sub-response is mapped back to its
+CalendarDtoPickled, and the operations whose sub-request failed are retried one by one through
+the regular client methods. Every sub-request takes a token of the session's rate limiter and
+is counted in its API calls, like a call of the client.
+
+The batched inserts and updates carry the poster of the event in its extended properties,
+like the CalendarApiClient does, so a write is a single sub-request. Updates are sent as
+patches, which keep the fields which aren't sent. A delete with a poster is sent one by one,
+the client cleans up the poster of the event it deletes. Everything is sent one by one if the
+client doesn't expose a service to batch on.
+"""
+
+import dataclasses
+import datetime
+from logging import getLogger
+from typing import Any, Callable
+
+from common_dto.events import CalendarDtoPickled
+
+from . import tracing
+from .calendar_session import CalendarSession
+from .rate_limiter import is_rate_limit_error
+
+logger = getLogger(__name__)
+
+INSERT = "insert"
+DELETE = "delete"
+
+# Google recommends at most 50 calls per batch request
+DEFAULT_BATCH_SIZE = 50
+
+
+@dataclasses.dataclass
+class CalendarOperation:
+    """
+    A write (insert or update) or a delete of the event of a CalendarDtoPickled.
+    """
+
+    kind: str
+    event: CalendarDtoPickled
+    description: str = ""
+    start_time: datetime.datetime | None = None
+    end_time: datetime.datetime | None = None
+    image_url: str | None = None
+    time_zone: str = ""
+
+
+def execute_in_batches(
+    calendar_session: CalendarSession,
+    operations: list[CalendarOperation],
+    single_operation: Callable[[CalendarOperation], None],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+):
+    """
+    Executes the operations in batch requests of batch_size operations and fills in
+    the calendar_id of the written events.
+
+    Args:
+        calendar_session (CalendarSession): The session whose client, rate limiter and
+            counters the batch requests go through.
+        operations (list[CalendarOperation]): The operations in the order to execute.
+        single_operation (Callable): Executes one operation through the client, used for
+            operations which can't be batched and to retry failed sub-requests.
+        batch_size (int): The number of operations per batch request.
+    """
+    google_calendar = calendar_session.client
+    service = getattr(google_calendar, "service", None)
+    if service is None or not hasattr(service, "new_batch_http_request"):
+        logger.warning(
+            "Calendar client doesn't expose a service, writing %d events one by one",
+            len(operations),
+        )
+        for operation in operations:
+            single_operation(operation)
+        return
+
+    calendar_id = getattr(google_calendar, "calendar_id", "primary")
+    batch_size = max(1, batch_size)
+
+    batchable = []
+    for operation in operations:
+        if operation.kind == DELETE and operation.image_url:
+            single_operation(operation)
+        else:
+            batchable.append(operation)
+
+    for index in range(0, len(batchable), batch_size):
+        chunk = batchable[index:index + batch_size]
+        failed = _execute_batch(calendar_session, service, calendar_id, chunk)
+        if failed:
+            logger.warning(
+                "%d of %d batched calendar operations failed, retrying them one by one",
+                len(failed),
+                len(chunk),
+            )
+        for operation in failed:
+            single_operation(operation)
+
+
+def _execute_batch(
+    calendar_session: CalendarSession,
+    service,
+    calendar_id: str,
+    chunk: list[CalendarOperation],
+) -> list[CalendarOperation]:
+    """Executes one batch request and returns the operations whose sub-request failed."""
+    failed: list[CalendarOperation] = []
+    rate_limited = False
+
+    def callback(request_id: str, response: Any, exception: Exception | None):
+        nonlocal rate_limited
+        operation = chunk[int(request_id)]
+        if exception is not None:
+            logger.debug(
+                "Batched %s of %s failed: %s",
+                operation.kind,
+                operation.event.summary,
+                exception,
+            )
+            rate_limited = rate_limited or is_rate_limit_error(exception)
+            failed.append(operation)
+        elif operation.kind == INSERT:
+            operation.event.calendar_id = response.get("id") if response else None
+
+    batch = service.new_batch_http_request(callback=callback)
+    for request_id, operation in enumerate(chunk):
+        batch.add(
+            _build_request(service, calendar_id, operation), request_id=str(request_id)
+        )
+        calendar_session.throttle(_get_call_name(operation))
+
+    with tracing.span("calendar_batch", operations=len(chunk)) as span:
+        try:
+            batch.execute()
+        except Exception as e:
+            logger.error(
+                "Batch request of %d calendar operations failed: %s", len(chunk), e
+            )
+            if is_rate_limit_error(e):
+                calendar_session.on_rate_limited()
+            span.count("failed", len(chunk))
+            return chunk
+        span.count("failed", len(failed))
+        # the failed operations are retried one by one, which backs off on rate limits
+        if rate_limited:
+            span.count("rate_limited")
+            calendar_session.on_rate_limited()
+        else:
+            calendar_session.on_success()
+    return failed
+
+
+def _get_call_name(operation: CalendarOperation) -> str:
+    if operation.kind == DELETE:
+        return "batch_delete"
+    return "batch_update" if operation.event.calendar_id else "batch_insert"
+
+
+def _build_request(service, calendar_id: str, operation: CalendarOperation):
+    events = service.events()
+    if operation.kind == DELETE:
+        return events.delete(calendarId=calendar_id, eventId=operation.event.calendar_id)
+
+    body = {
+        "summary": operation.event.summary,
+        "description": operation.description,
+        "start": {
+            "dateTime": operation.start_time.isoformat(),
+            "timeZone": operation.time_zone,
+        },
+        "end": {
+            "dateTime": operation.end_time.isoformat(),
+            "timeZone": operation.time_zone,
+        },
+    }
+    if operation.image_url:
+        body["extendedProperties"] = {"private": {"image": str(operation.image_url)}}
+    if operation.event.calendar_id:
+        # a patch keeps the fields which aren't sent
+        return events.patch(
+            calendarId=calendar_id, eventId=operation.event.calendar_id, body=body
+        )
+    return events.insert(calendarId=calendar_id, body=body)
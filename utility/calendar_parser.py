@@ -0,0 +1,221 @@
+"""
+This module contains the parser engines for the calendar page of next episode.
+
+Every engine reads the month and year of the page, finds the day cells of the calendar
+table and extracts the (title, href, time) of every show in a day cell. The
+BeautifulSoup engine is the reference implementation, the lxml engine is the fast one.
+Both return the same data, so the results of the two can be compared on the same page.
+"""
+
+# pyright: reportGeneralTypeIssues=false, reportOptionalMemberAccess=false, reportAttributeAccessIssue=false
+
+import datetime
+from typing import Any
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html as lxml_html
+except ImportError:  # lxml is optional, the reference engine is used without it
+    lxml_html = None
+
+ShowEntry = tuple[str, str, str]  # title, href, time
+DayCell = tuple[int, Any]  # day of the month, engine specific cell
+
+BS4_BACKEND = "bs4"
+LXML_BACKEND = "lxml"
+
+
+def get_month_year_from_html(soup):
+    select_tag = soup.find("select", {"id": "month"})
+    selected_option = select_tag.find("option", {"selected": True})
+    month_ = selected_option.text.strip()  # Get the text of the selected option
+
+    # Step 2: Extract the year
+    year_tag = select_tag.find_next("span")  # Find the adjacent span tag
+    year_ = year_tag.text.strip()  # Get the text of the span tag
+
+    return _month_year_to_int(month_, year_)
+
+
+def _month_year_to_int(month_: str, year_: str) -> tuple[int, int]:
+    # month [April] and year should be integer
+    month_ = month_.lower()
+    month_ = month_.capitalize()
+    month_ = datetime.datetime.strptime(month_, "%B").month
+    year_ = int(year_)
+    return month_, year_
+
+
+class CalendarParser:
+    """
+    Base class of the calendar page parser engines.
+    """
+
+    name: str = ""
+
+    def parse(self, page_content: str) -> tuple[int, int, list[DayCell]]:
+        """
+        Parses the page and returns the month, the year and the day cells of the calendar.
+
+        Args:
+            page_content (str): The page content of the calendar page from next episode.
+
+        Returns:
+            tuple: The month, the year and a list of (day, cell) in page order.
+        """
+        raise NotImplementedError
+
+    def extract_shows(self, cell: Any) -> list[ShowEntry]:
+        """
+        Extracts the (title, href, time) of every show of a day cell.
+
+        Args:
+            cell: A day cell returned by parse.
+
+        Returns:
+            list: A list of (title, href, time) tuples in page order.
+        """
+        raise NotImplementedError
+
+    def cell_fragment(self, cell: Any) -> bytes:
+        """
+        Returns the markup of a day cell, used to fingerprint the day.
+
+        Args:
+            cell: A day cell returned by parse.
+
+        Returns:
+            bytes: The serialized cell.
+        """
+        raise NotImplementedError
+
+
+class BeautifulSoupCalendarParser(CalendarParser):
+    """
+    The reference engine, it walks the full html.parser tree of the page.
+    """
+
+    name = BS4_BACKEND
+
+    def parse(self, page_content: str) -> tuple[int, int, list[DayCell]]:
+        soup = BeautifulSoup(page_content, "html.parser")
+        month, year = get_month_year_from_html(soup)
+
+        day_cells = []
+        for span in soup.find_all("span"):
+            if (
+                span.string and span.string.strip().isdigit()
+            ):  # Check if the span contains a number (the day)
+                day_cells.append((int(span.string.strip()), span.parent.parent))
+        return month, year, day_cells
+
+    def extract_shows(self, cell: Any) -> list[ShowEntry]:
+        shows = cell.find_all("div", class_="cal_name")
+        if not shows:
+            return []
+        times = cell.find_all("div", class_="cal_more")
+        return [
+            (
+                show.find("a")["title"],
+                show.find("a")["href"],
+                TIME.find("div", class_="h").text,
+            )
+            for show, TIME in zip(shows, times)
+        ]
+
+    def cell_fragment(self, cell: Any) -> bytes:
+        return str(cell).encode()
+
+
+class LxmlCalendarParser(CalendarParser):
+    """
+    The fast engine, it only visits the table cells and reads every day cell in a single pass.
+    """
+
+    name = LXML_BACKEND
+
+    def parse(self, page_content: str) -> tuple[int, int, list[DayCell]]:
+        root = lxml_html.document_fromstring(page_content)
+        month, year = self._get_month_year(root)
+
+        day_cells = []
+        for td in root.iter("td"):
+            for child in td:
+                for span in child:
+                    if span.tag != "span":
+                        continue
+                    day = _single_string(span)
+                    if day and day.strip().isdigit():
+                        day_cells.append((int(day.strip()), td))
+        return month, year, day_cells
+
+    def extract_shows(self, cell: Any) -> list[ShowEntry]:
+        names = []
+        times = []
+        for div in cell.iter("div"):
+            classes = div.get("class", "").split()
+            if "cal_name" in classes:
+                anchor = next(div.iter("a"))
+                names.append((anchor.attrib["title"], anchor.attrib["href"]))
+            elif "cal_more" in classes:
+                times.append(_get_time_text(div))
+        return [
+            (title, href, time_str) for (title, href), time_str in zip(names, times)
+        ]
+
+    def cell_fragment(self, cell: Any) -> bytes:
+        return lxml_html.tostring(cell, with_tail=False)
+
+    @staticmethod
+    def _get_month_year(root) -> tuple[int, int]:
+        select_tag = root.xpath("//select[@id='month']")[0]
+        selected_option = select_tag.xpath(".//option[@selected]")[0]
+        year_tag = select_tag.xpath("following::span[1]")[0]
+        return _month_year_to_int(
+            selected_option.text_content().strip(), year_tag.text_content().strip()
+        )
+
+
+def _get_time_text(cal_more) -> str | None:
+    """Returns the text of the first div.h inside a div.cal_more."""
+    for div in cal_more.iter("div"):
+        if div is not cal_more and "h" in div.get("class", "").split():
+            return div.text_content()
+    return None
+
+
+def _single_string(element) -> str | None:
+    """Mirrors BeautifulSoup's Tag.string: the text of an element with a single text child."""
+    if len(element) == 0:
+        return element.text
+    if len(element) == 1 and not element.text and not element[0].tail:
+        return _single_string(element[0])
+    return None
+
+
+PARSER_BACKENDS: dict[str, type[CalendarParser]] = {
+    BS4_BACKEND: BeautifulSoupCalendarParser,
+}
+if lxml_html is not None:
+    PARSER_BACKENDS[LXML_BACKEND] = LxmlCalendarParser
+
+DEFAULT_PARSER_BACKEND = LXML_BACKEND if lxml_html is not None else BS4_BACKEND
+
+
+def get_calendar_parser(backend: str | None = None) -> CalendarParser:
+    """
+    Returns the parser engine for the given backend name.
+
+    Args:
+        backend (str | None): "lxml" or "bs4", None for the default engine.
+
+    Returns:
+        CalendarParser: The parser engine.
+    """
+    backend = backend or DEFAULT_PARSER_BACKEND
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(
+            f"Unknown calendar parser backend {backend!r}, expected one of {sorted(PARSER_BACKENDS)}."
+        )
+    return PARSER_BACKENDS[backend]()
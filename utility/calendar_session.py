@@ -0,0 +1,211 @@
+"""
+This module contains the run-scoped Google Calendar session.
+
+A run used to construct a new calendar client per event, which loads the credentials,
+discovers the service and opens a new connection every time. The session creates the
+client once, hands the same authorized client to every write and delete of the run,
+and counts the clients, connections and API calls made.
+
+The session also owns the settings of the concurrent writers: the number of worker
+threads and the rate limiter every API call goes through. The authorized http of a client
+isn't thread-safe, so every worker thread gets its own client.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import itertools
+from logging import getLogger
+import threading
+import time
+from typing import Callable
+
+from gdrive_tool import my_google_calendar
+
+from . import tracing
+from .rate_limiter import AdaptiveTokenBucket, backoff_delay, is_rate_limit_error
+
+logger = getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 5
+
+
+class CalendarSession:
+    """
+    Owns the calendar clients of a run, its rate limiter and its counters.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable = my_google_calendar.GoogleCalendar,
+        max_workers: int = 1,
+        rate_limiter: AdaptiveTokenBucket | None = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self._client_factory = client_factory
+        self._local = threading.local()
+        self._client = None
+        self._clients: list = []
+        self._lock = threading.Lock()
+        self.max_workers = max(1, max_workers)
+        self._executor: ThreadPoolExecutor | None = None
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Resets the API call counters, the next ones belong to a new run. The clients and
+        their connections are kept.
+        """
+        with self._lock:
+            self.api_calls: Counter[str] = Counter()
+            self.rate_limited = 0
+
+    @property
+    def clients_created(self) -> int:
+        return len(self._clients)
+
+    @property
+    def client(self):
+        """
+        The calendar client of the run (of the current worker thread when there are
+        several workers), created on first use.
+        """
+        # a single writer never calls the client concurrently, whichever thread it runs on
+        local = self if self.max_workers <= 1 else self._local
+        client = getattr(local, "_client", None)
+        if client is None:
+            client = self._client_factory()
+            local._client = client
+            with self._lock:
+                self._clients.append(client)
+            logger.debug("Created calendar client #%d", self.clients_created)
+        return client
+
+    def count_call(self, name: str):
+        """
+        Counts an API call made through the client.
+        """
+        with self._lock:
+            self.api_calls[name] += 1
+
+    def throttle(self, name: str, calls: int = 1):
+        """
+        Takes a token of the rate limiter and counts the call, for each of the calls. The
+        sub-requests of a batch request count against the quota one by one.
+        """
+        for _ in range(calls):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            self.count_call(name)
+
+    def on_rate_limited(self):
+        """
+        Slows the rate limiter down after the API answered with a rate limit error.
+        """
+        with self._lock:
+            self.rate_limited += 1
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_rate_limited()
+
+    def on_success(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_success()
+
+    def call(self, name: str, **kwargs):
+        """
+        Calls a method of the client through the rate limiter, and retries it with
+        a jittered exponential backoff when the API answers with a rate limit error.
+
+        Args:
+            name (str): The name of the client method, e.g. "create_event_v2".
+            **kwargs: The arguments of the method.
+
+        Returns:
+            The result of the method.
+        """
+        with tracing.span("calendar_call", method=name) as span:
+            return self._call(name, span, **kwargs)
+
+    def _call(self, name: str, span: tracing.Span, **kwargs):
+        for attempt in itertools.count():
+            self.throttle(name)
+            try:
+                result = getattr(self.client, name)(**kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                span.count("rate_limited")
+                self.on_rate_limited()
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    "Calendar API rate limit hit on %s, retrying in %.1f secs", name, delay
+                )
+                time.sleep(delay)
+                continue
+
+            self.on_success()
+            return result
+
+    def map(self, function: Callable, items: list) -> list:
+        """
+        Maps the function over the items on the worker threads of the session, keeping the order.
+        The workers live as long as the session, so each of them creates a single client.
+
+        Args:
+            function (Callable): The function to call with every item.
+            items (list): The items.
+
+        Returns:
+            list: The results in the order of the items.
+        """
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="calendar-writer"
+            )
+        # the spans of the workers are children of the span the items are mapped in
+        return list(
+            self._executor.map(
+                lambda context, item: context.run(function, item),
+                [contextvars.copy_context() for _ in items],
+                items,
+            )
+        )
+
+    def close(self):
+        """
+        Shuts the worker threads of the session down.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def stats(self) -> dict:
+        """
+        Returns the clients, connections and API calls of the run.
+        """
+        return {
+            "clients_created": self.clients_created,
+            "connections_created": sum(
+                _count_connections(client) for client in self._clients
+            ),
+            "api_calls": dict(self.api_calls),
+            "rate_limited": self.rate_limited,
+        }
+
+
+def _count_connections(client) -> int:
+    """
+    Counts the open connections of the authorized http of the client's service,
+    falling back to one connection pool per client if it can't be inspected.
+    """
+    http = getattr(getattr(client, "service", None), "_http", None)
+    # google_auth_httplib2.AuthorizedHttp wraps the httplib2.Http
+    http = getattr(http, "http", http)
+    connections = getattr(http, "connections", None)
+    if isinstance(connections, dict):
+        return len(connections)
+    return 1
@@ -1,3 +1,5 @@
+import dataclasses
+
 from common_dto.events import CalendarDtoPickled
 
 
@@ -153,3 +155,92 @@ def return_new_list_of_series_which_actually_is_updated_v2(
     new_series = [event for event in series_list if event not in old_series_list]
 
     return new_series
+
+
+@dataclasses.dataclass
+class MonthDiff:
+    """
+    The result of diffing the old and the new series list of a month.
+
+    added: new events whose summary wasn't in the old list
+    changed: new events whose summary was in the old list with another date, time or url
+    removed: old events whose title isn't in the new list anymore
+    unchanged: new events which are exactly in the old list
+    updated: added and changed in the order of the new list, i.e. the events to write
+    """
+
+    added: list[CalendarDtoPickled] = dataclasses.field(default_factory=list)
+    changed: list[CalendarDtoPickled] = dataclasses.field(default_factory=list)
+    removed: list[CalendarDtoPickled] = dataclasses.field(default_factory=list)
+    unchanged: list[CalendarDtoPickled] = dataclasses.field(default_factory=list)
+    updated: list[CalendarDtoPickled] = dataclasses.field(default_factory=list)
+
+
+def _event_identity(event: CalendarDtoPickled) -> tuple:
+    return event.summary, event.url, event.start_time, event.start_date
+
+
+def diff_month_events(
+    old_events: list[CalendarDtoPickled],
+    new_events: list[CalendarDtoPickled],
+    kept_events: list[CalendarDtoPickled] | None = None,
+) -> MonthDiff:
+    """
+    Diffs the old and the new series list of a month with hash lookups, in time linear
+    to the size of both lists, and carries the calendar ids of the old events over to
+    the unchanged and changed new events.
+
+    Parameters
+    ----------
+    old_events : list
+        The list of old events
+    new_events : list
+        The list of new events
+    kept_events : list | None
+        Events outside the two lists which still exist (e.g. of unchanged days),
+        old events with their titles are never removed
+
+    Returns
+    -------
+    MonthDiff
+        The added, changed, removed, unchanged and updated events
+    """
+    diff = MonthDiff()
+
+    old_by_identity: dict[tuple, CalendarDtoPickled] = {}
+    for event in old_events:
+        old_by_identity[_event_identity(event)] = event
+
+    matched_old_events: set[int] = set()  # ids of the old events of unchanged ones
+    new_titles = {_get_title_from_event_v2(event) for event in kept_events or []}
+    for event in new_events:
+        new_titles.add(_get_title_from_event_v2(event))
+        old_event = old_by_identity.get(_event_identity(event))
+        if old_event is not None:
+            matched_old_events.add(id(old_event))
+            event.calendar_id = old_event.calendar_id
+            diff.unchanged.append(event)
+        else:
+            diff.updated.append(event)
+
+    # old events which weren't matched exactly are the candidates for a changed event
+    unmatched_old_by_summary: dict[str, list[CalendarDtoPickled]] = {}
+    for event in old_events:
+        if id(event) not in matched_old_events:
+            unmatched_old_by_summary.setdefault(event.summary, []).append(event)
+
+    for event in diff.updated:
+        candidates = unmatched_old_by_summary.get(event.summary)
+        if candidates:
+            event.calendar_id = candidates.pop(0).calendar_id
+            diff.changed.append(event)
+        else:
+            diff.added.append(event)
+
+    diff.removed = [
+        event
+        for event in old_events
+        if _get_title_from_event_v2(event) not in new_titles
+    ]
+
+    return diff
@@ -1,30 +1,192 @@
+import hashlib
+import json
 import logging
+import pathlib
 import re
+from collections import Counter
 
-series_filter = {"plain_filter": set(), "regex_filter": set()}
+logger = logging.getLogger(__name__)
 
-series_filter["plain_filter"].add("The Last of Us - 2xSpecial".lower())
-series_filter["plain_filter"].add("Andor - 2xSpecial - Season 2".lower())
+FILTERS_FILE = pathlib.Path(__file__).parent.parent.joinpath("series_filters.json")
 
-series_filter["regex_filter"].add(r"-\s(\d+xspecial)\s-")
+# used when the filters file is missing
+DEFAULT_SERIES_FILTER = {
+    "plain_filter": [
+        "The Last of Us - 2xSpecial",
+        "Andor - 2xSpecial - Season 2",
+    ],
+    "regex_filter": [r"-\s(\d+xspecial)\s-"],
+}
 
+# memoized titles before the memo is reset
+MAX_MEMOIZED_TITLES = 100_000
 
-def filter_series(series_name: str) -> bool:
-    # Check plain filters
-    for series in series_filter["plain_filter"]:
-        if series in series_name.lower():
-            logging.info(f"Filtered out {series_name}")
-            return True
+# numbered backreferences and conditionals refer to the groups of the pattern, whose
+# numbers shift inside the alternation; a false positive only costs a separate search
+_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?\(")
+
+
+class SeriesFilterEngine:
+    """
+    Matches series names against plain (substring) and regex rules with a single compiled
+    alternation regex, so the cost of a check doesn't grow with the number of rules.
+    The result of every title is memoized, and the matches are counted per rule.
+
+    Every regex rule is compiled on its own first: an invalid one is logged and skipped, and
+    one which can't be part of the alternation (backreferences, named groups, global inline
+    flags) is searched on its own after it.
+    """
+
+    def __init__(self, plain_filters: list[str], regex_filters: list[str]):
+        self.plain_filters = sorted({series.lower() for series in plain_filters})
+        self.regex_filters = sorted(set(regex_filters))
+
+        self._rules: dict[str, str] = {}
+        self._separate_matchers: list[tuple[str, re.Pattern]] = []
+        alternatives = []
+        for series in self.plain_filters:
+            alternatives.append(self._add_rule(re.escape(series), series))
+        for pattern in self.regex_filters:
+            try:
+                matcher = re.compile(pattern)
+            except re.error as e:
+                logger.error("Skipping the invalid series filter regex %r: %s", pattern, e)
+                continue
+            if _can_combine(pattern, matcher):
+                alternatives.append(self._add_rule(pattern, pattern))
+            else:
+                logger.debug("Series filter regex %r is searched on its own", pattern)
+                self._separate_matchers.append((pattern, matcher))
+        self._matcher = re.compile("|".join(alternatives)) if alternatives else None
+
+        self.signature = hashlib.sha256(
+            json.dumps([self.plain_filters, self.regex_filters]).encode()
+        ).hexdigest()
+
+        self._memo: dict[str, bool] = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Resets the counters, e.g. between the refreshes of the daemon. The memo is kept.
+        """
+        self.checked = 0
+        self.memo_hits = 0
+        self.filtered = 0
+        self.rule_matches: Counter[str] = Counter()
+
+    def _add_rule(self, pattern: str, rule: str) -> str:
+        group = f"_rule{len(self._rules)}"
+        self._rules[group] = rule
+        return f"(?P<{group}>{pattern})"
+
+    @classmethod
+    def from_file(cls, path: pathlib.Path = FILTERS_FILE) -> "SeriesFilterEngine":
+        """
+        Loads the plain and regex rules from a JSON file of the form
+        {"plain_filter": [...], "regex_filter": [...]}. The default rules are used if the
+        file can't be read or isn't of that form, rules which aren't strings are skipped.
+        """
+        config = DEFAULT_SERIES_FILTER
+        if path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    loaded = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.error("Failed to load series filters from %s: %s", path, e)
+            else:
+                if isinstance(loaded, dict):
+                    config = loaded
+                else:
+                    logger.error(
+                        "Series filters in %s aren't a JSON object, using the defaults", path
+                    )
+        return cls(
+            _get_rules(config, "plain_filter", path), _get_rules(config, "regex_filter", path)
+        )
+
+    def is_filtered(self, series_name: str) -> bool:
+        """
+        Returns True if the series name matches any of the rules.
+        """
+        self.checked += 1
+        result = self._memo.get(series_name)
+        if result is not None:
+            self.memo_hits += 1
+            if result:
+                self.filtered += 1
+            return result
 
-    # Check regex filters
-    for pattern in series_filter["regex_filter"]:
-        match = re.search(pattern, series_name.lower())
+        result = False
+        lowered = series_name.lower()
+        if self._matcher is not None:
+            match = self._matcher.search(lowered)
+            if match:
+                self.rule_matches[self._rules[match.lastgroup]] += 1
+                result = True
+        if not result:
+            for pattern, matcher in self._separate_matchers:
+                if matcher.search(lowered):
+                    self.rule_matches[pattern] += 1
+                    result = True
+                    break
 
-        if match:
-            logging.info(f"Filtered out {series_name}")
-            return True
+        if len(self._memo) >= MAX_MEMOIZED_TITLES:
+            self._memo.clear()
+        self._memo[series_name] = result
+        if result:
+            self.filtered += 1
+        return result
 
-    return False
+    def stats(self) -> dict:
+        """
+        Returns the counters of the engine.
+        """
+        return {
+            "checked": self.checked,
+            "memo_hits": self.memo_hits,
+            "filtered": self.filtered,
+            "rule_matches": dict(self.rule_matches),
+        }
+
+
+def _can_combine(pattern: str, matcher: re.Pattern) -> bool:
+    if matcher.groupindex or _GROUP_REFERENCE.search(pattern):
+        return False
+    # global inline flags are only allowed at the start of the whole regex
+    try:
+        re.compile(f"(?:{pattern})")
+    except re.error:
+        return False
+    return True
+
+
+def _get_rules(config: dict, key: str, path: pathlib.Path) -> list[str]:
+    rules = config.get(key, [])
+    if not isinstance(rules, list):
+        logger.error("%s in %s isn't a list, ignoring it", key, path)
+        return []
+    for rule in rules:
+        if not isinstance(rule, str):
+            logger.error("Skipping the %s rule %r of %s, it isn't a string", key, rule, path)
+    return [rule for rule in rules if isinstance(rule, str)]
+
+
+_series_filter_engine: SeriesFilterEngine | None = None
+
+
+def get_series_filter_engine() -> SeriesFilterEngine:
+    """
+    Returns the filter engine of the filters file, loaded on first use.
+    """
+    global _series_filter_engine
+    if _series_filter_engine is None:
+        _series_filter_engine = SeriesFilterEngine.from_file()
+    return _series_filter_engine
+
+
+def filter_series(series_name: str) -> bool:
+    return get_series_filter_engine().is_filtered(series_name)
 
 
 if __name__ == "__main__":
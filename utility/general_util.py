@@ -1,5 +1,9 @@
+import logging
+
 from common_dto.events import CalendarDtoPickled
 
+logger = logging.getLogger(__name__)
+
 
 def get_anime_url_from_events(events: list) -> list:
     """
@@ -55,7 +59,7 @@ def clean_not_existing_series_data_from_image_mapping(
     None
     """
 
-    print("Cleaning series data from image mappings...")
+    logger.debug("Cleaning series data from image mappings...")
     keys = set()
     for values in series_dict.values():
         for event in values:
@@ -69,7 +73,7 @@ def clean_not_existing_series_data_from_image_mapping(
             # del image_dict[key]
             keys_to_be_deleted.append(key)
 
-    print(keys_to_be_deleted)
+    logger.debug("Image mappings to be deleted: %s", keys_to_be_deleted)
 
     return keys_to_be_deleted
 
@@ -94,7 +98,7 @@ def clean_not_existing_series_data_from_image_mapping_v2(
     if image_dict is None:
         return []
 
-    print("Cleaning series data from image mappings...")
+    logger.debug("Cleaning series data from image mappings...")
     keys = set()
     for values in series_dict.values():
         for event in values:
@@ -108,7 +112,7 @@ def clean_not_existing_series_data_from_image_mapping_v2(
             # del image_dict[key]
             keys_to_be_deleted.append(key)
 
-    print(keys_to_be_deleted)
+    logger.debug("Image mappings to be deleted: %s", keys_to_be_deleted)
 
     return keys_to_be_deleted
 
@@ -1,120 +1,295 @@
 """
-This module provides functionality to download images from a given URL and save them to a local directory.
+This module provides functionality to download images from a given URL and save them
+to the content-addressed image store.
 
-Functions:
-    get_image_from_url(session: requests.Session, url: str) -> Path | None:
-        Downloads the image of the anime from the given URL and returns the path to the saved image.
+Classes:
+    ImageDownloadService:
+        Downloads the images of a run on one event loop with one persistent client,
+        at most max_concurrency requests at a time.
 
-    _save_image_from_url(url: str) -> Path | None:
-        Downloads an image from the given URL and saves it to the images folder.
+Functions:
+    download_image_from_urls(urls: list[str]) -> dict | None:
+        Downloads the images of the given anime URLs with the default service.
 """
 
 from pathlib import Path
 import asyncio
+import contextvars
 import logging
+import os
+import time
+import uuid
 
 import aiofiles
 import httpx
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
+from . import tracing
+from .image_store import ContentAddressedImageStore
 from .series_to_image_mapping import SeriesToImageMapping
+from .state_store import SeriesStateStore
 
 logger = logging.getLogger(__name__)
 
-IMAGE_PATH = Path(__file__).parent.parent.joinpath("images")  # utility  # src
-if not IMAGE_PATH.exists():
-    IMAGE_PATH.mkdir()
+DEFAULT_MAX_CONCURRENCY = 8
+CHUNK_SIZE = 64 * 1024
+# the show page is only fetched again for its poster url once a week
+DEFAULT_POSTER_URL_TTL = 7 * 24 * 60 * 60
 
+POSTER_STRAINER = SoupStrainer("img", id="big_image")
 
-series_to_image_mapping = SeriesToImageMapping()
 
-
-async def _get_image_from_url(session: httpx.AsyncClient, url: str) -> Path | None:
-    """
-    Downloads the image of the anime from the given URL asynchronously
-    and returns the path to the saved image.
+class ImageDownloadService:
     """
+    Downloads the anime images of a run.
 
-    image_mapping = series_to_image_mapping.get_mapping()
-    if image_mapping is None:
-        image_mapping = {}
-
-    image_name = url.split("/")[-1]
-    image_path = IMAGE_PATH.joinpath(image_name + ".jpg")
+    The service owns one event loop (an asyncio.Runner) and one httpx.AsyncClient for its
+    whole lifetime, limits the requests in flight with a semaphore and streams every image
+    to a temporary file which is moved into the image store once it is complete.
 
-    if image_path.exists():
-        logger.info("Image {} already exists, skipping download.".format(image_name))
-        image_mapping[url] = str(image_path)
+    The poster url of every show page is cached in the state store. A cached url is used as
+    long as it's younger than poster_url_ttl seconds; an expired one is still used, and the
+    show page is fetched again in the background to pick up a changed poster.
+    """
 
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        image_store: ContentAddressedImageStore | None = None,
+        poster_url_ttl: float = DEFAULT_POSTER_URL_TTL,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.image_store = image_store or ContentAddressedImageStore()
+        self.poster_url_ttl = poster_url_ttl
+        self._transport = transport
+        self._state_store = SeriesStateStore()
+        self._runner: asyncio.Runner | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._mapping_lock: asyncio.Lock | None = None
+        self._revalidations: dict[str, asyncio.Task] = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Resets the counters, the next ones belong to a new run.
+        """
+        self.downloaded = 0
+        # downloads whose image was already stored from another poster url
+        self.deduplicated = 0
+        self.failed = 0
+        self.show_pages_fetched = 0
+        self.poster_url_hits = 0
+        self.posters_changed = 0
+
+    def download(self, urls: list[str]) -> None:
+        """
+        Downloads the images of the anime URLs which aren't in the mapping yet, blocking.
+        Revalidations still running carry on the next time the loop runs.
+        """
+        self.run(self.download_async(urls))
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the event loop of the service, blocking.
+        """
+        if self._runner is None:
+            self._runner = asyncio.Runner()
+        # the runner would otherwise keep the context of its first run, spans included
+        return self._runner.run(coroutine, context=contextvars.copy_context())
+
+    async def download_async(self, urls: list[str]) -> None:
+        """
+        Downloads the images of the anime URLs which aren't in the mapping yet,
+        and revalidates the expired poster urls of the ones which are.
+        """
+        image_mapping = _get_image_mapping()
+        urls = set(urls)
+        final_urls = [url for url in urls if url not in image_mapping]
+        logger.debug("Final URLs to download: %s", final_urls)
+
+        self._ensure_client()
+        for url in urls.difference(final_urls):
+            cached = self._state_store.get_poster_url(url)
+            if cached is not None and self._is_expired(cached[1]):
+                self._revalidate_in_background(url, cached[0])
+
+        if not final_urls:
+            return
+        with tracing.span("download_images", urls=len(final_urls)) as span:
+            results = await asyncio.gather(
+                *(self._get_image_from_url(url) for url in final_urls),
+                return_exceptions=True,
+            )
+            for url, result in zip(final_urls, results):
+                if isinstance(result, BaseException):
+                    self.failed += 1
+                    span.count("failed")
+                    logger.warning("Failed to download the image of %s: %s", url, result)
+
+    def flush(self) -> None:
+        """
+        Waits for the background revalidations, keeping the client and the event loop open.
+        """
+        if self._runner is not None:
+            self._runner.run(self._wait_for_revalidations())
+
+    def close(self) -> None:
+        """
+        Waits for the background revalidations and closes the client and the event loop.
+        """
+        if self._runner is not None:
+            self._runner.run(self.aclose())
+            self._runner.close()
+            self._runner = None
+
+    async def aclose(self) -> None:
+        await self._wait_for_revalidations()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "downloaded": self.downloaded,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "show_pages_fetched": self.show_pages_fetched,
+            "poster_url_hits": self.poster_url_hits,
+            "posters_changed": self.posters_changed,
+        }
+
+    async def _wait_for_revalidations(self):
+        if self._revalidations:
+            await asyncio.gather(*self._revalidations.values(), return_exceptions=True)
+            self._revalidations.clear()
+
+    def _ensure_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(http2=True, transport=self._transport)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._mapping_lock = asyncio.Lock()
+
+    def _is_expired(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at > self.poster_url_ttl
+
+    async def _get_image_from_url(self, url: str) -> Path | None:
+        """
+        Downloads the image of the anime from the given URL asynchronously
+        and returns the path to the saved image.
+        """
+        with tracing.span("download_image"):
+            return await self._download_image(url)
+
+    async def _download_image(self, url: str) -> Path | None:
+        cached = self._state_store.get_poster_url(url)
+        if cached is not None:
+            self.poster_url_hits += 1
+            src, fetched_at = cached
+            if self._is_expired(fetched_at):
+                self._revalidate_in_background(url, src)
+        else:
+            src = await self._fetch_poster_url(url)
+        if not src:
+            return None
+
+        image_path = await self._save_image_from_url(src)
+        if image_path:
+            await self._set_image_mapping(url, image_path)
         return image_path
 
-    # async with session.get(url) as resp:
-    #     html = await resp.text()
-    intermediate_response = await session.get(url)
-    html = intermediate_response.text
-    soup = BeautifulSoup(html, "html.parser")
-    img = soup.find("img", id="big_image")
-    if not img or not img.get("src"):
-        return None
+    async def _fetch_poster_url(self, url: str) -> str | None:
+        """
+        Fetches the show page and caches the url of its poster.
+        """
+        async with self._semaphore:
+            intermediate_response = await self._client.get(url)
+        self.show_pages_fetched += 1
+        src = _find_poster_url(intermediate_response.text)
+        if src:
+            self._state_store.save_poster_url(url, src, time.time())
+        return src
+
+    def _revalidate_in_background(self, url: str, src: str):
+        if url not in self._revalidations:
+            self._revalidations[url] = asyncio.create_task(self._revalidate(url, src))
+
+    async def _revalidate(self, url: str, src: str):
+        try:
+            new_src = await self._fetch_poster_url(url)
+            if not new_src or new_src == src:
+                return
+            logger.info("Poster of %s changed to %s", url, new_src)
+            self.posters_changed += 1
+            image_path = await self._save_image_from_url(new_src)
+            if image_path:
+                await self._set_image_mapping(url, image_path)
+        except Exception as e:
+            logger.warning("Failed to revalidate the poster of %s: %s", url, e)
+
+    async def _save_image_from_url(self, url: str) -> Path | None:
+        if not url:
+            return None
+
+        image_path = self.image_store.get_image_for_source(url)
+        if image_path is not None:
+            logger.debug("Image %s already exists, skipping download.", url)
+            return image_path
+
+        # a unique temporary name, two shows may share the same poster
+        temp_path = self.image_store.root.joinpath(f".{uuid.uuid4().hex}.part")
+        try:
+            async with self._semaphore:
+                async with self._client.stream("GET", url) as resp:
+                    resp.raise_for_status()
+                    async with aiofiles.open(temp_path, "wb") as f:
+                        async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                            await f.write(chunk)
+                            tracing.count("bytes", len(chunk))
+            image_path, stored = await self.image_store.add(temp_path, url)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        if stored:
+            self.downloaded += 1
+        else:
+            self.deduplicated += 1
+        return image_path
 
-    image_path = await _save_image_from_url(session, str(img["src"]))
-    if image_path:
-        image_mapping[url] = str(image_path)
-    return image_path
+    async def _set_image_mapping(self, url: str, image_path: Path):
+        async with self._mapping_lock:
+            _get_image_mapping()[url] = str(image_path)
 
 
-async def _save_image_from_url(session: httpx.AsyncClient, url: str) -> Path | None:
-    if not url:
+def _find_poster_url(html: str) -> str | None:
+    # only the poster is parsed out of the show page
+    soup = BeautifulSoup(html, "html.parser", parse_only=POSTER_STRAINER)
+    img = soup.find("img", id="big_image")
+    if not img or not img.get("src"):
         return None
+    return str(img["src"])
 
-    image_name = url.split("/")[-1]
-    image_path = IMAGE_PATH.joinpath(image_name)
 
-    if image_path.exists():
-        logger.info("Image {} already exists, skipping download.".format(image_name))
-        return image_path
-
-    resp = await session.get(url)
-    content = resp.content  # bytes directly
+def _get_image_mapping() -> dict:
+    image_mapping = SeriesToImageMapping().get_mapping()
+    if image_mapping is None:
+        image_mapping = {}
+    return image_mapping
 
-    async with aiofiles.open(image_path, "wb") as f:
-        await f.write(content)
 
-    return image_path
+_default_service: ImageDownloadService | None = None
 
 
-async def _bulk_download(urls: list[str]) -> None:
+def download_image_from_urls(urls: list[str]) -> dict | None:
     """
-    Downloads anime images from multiple page URLs concurrently.
+    Downloads the images of the given anime URLs with the default service of the process.
     """
-    async with httpx.AsyncClient(http2=True) as client:
-        tasks = [_get_image_from_url(client, url) for url in urls]
-        if len(tasks) != 0:
-            await asyncio.gather(*tasks)
-
-    # async with aiohttp.ClientSession() as session:
-    #     tasks = [_get_image_from_url(session, url) for url in urls]
-    #     if len(tasks) != 0:
-    #         await asyncio.gather(*tasks)
-
-
-def download_image_from_urls(urls: list[str]) -> dict | None:
-    # test_urls = [
-    #     "https://next-episode.net/wednesday",
-    #     "https://next-episode.net/alice-in-borderland",
-    #     "https://next-episode.net/my-hero-academia",
-    # ]
-
-    image_mapping = series_to_image_mapping.get_mapping()
-    if image_mapping is None:
-        image_mapping = {}
-
-    final_urls = set(urls)
-    final_urls = [url for url in final_urls if url not in image_mapping]
-    print("Final URLs to download:", final_urls)
-    if not final_urls and len(final_urls) == 0:
-        return None
-    asyncio.run(_bulk_download(final_urls))
+    global _default_service
+    if _default_service is None:
+        _default_service = ImageDownloadService()
+    _default_service.download(urls)
     return None
 
 
@@ -4,8 +4,12 @@ This module contains functions for retrieving series data from next episode.
 
 # pyright: reportGeneralTypeIssues=false, reportOptionalMemberAccess=false, reportAssignmentType = false
 
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import datetime
-import time
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit
 import warnings
 
 from bs4 import BeautifulSoup
@@ -13,19 +17,35 @@ from bs4.element import Tag
 from common_dto.events import CalendarDtoPickled
 import httpx
 
-from utility.event_filter_utility import (
-    return_new_list_of_series_which_actually_is_updated_v2,
-    return_no_longer_existing_event_v2,
-)
-from utility.filters_util import filter_series
-from utility.general_util import fill_new_series_list_calendar_ids
-from utility.time_utility import merge_time_str_datetime_date
+from utility.calendar_parser import get_calendar_parser
+from utility.event_filter_utility import diff_month_events
+from utility.filters_util import filter_series, get_series_filter_engine
+from utility.http_cache import CalendarPageCache
+from utility.refresh_scheduler import MonthRefreshScheduler
+from utility.time_utility import get_event_start_end
+from utility import tracing
+
+logger = logging.getLogger(__name__)
+
+NEXT_EPISODE_URL = "https://next-episode.net"
+BASE_URL = f"{NEXT_EPISODE_URL}/calendar/"
+# the scheme and host the show links are resolved against, None for the protocol-relative
+# links of the real site
+_link_base: tuple[str, str] | None = None
+
+# number of month pages fetched at the same time
+DEFAULT_FETCH_CONCURRENCY = 4
 
 NO_LONGER_EXISTING_EVENTS = []
 
 
 def get_series_data_for_the_current_month_btw_start_date_end_date_v2(
-    page_content: str, start_date, end_date, month: int, year: int
+    page_content: str,
+    start_date,
+    end_date,
+    month: int,
+    year: int,
+    parser_backend: str | None = None,
 ) -> list[CalendarDtoPickled]:
     """
     This function takes the page content of the calendar page from next episode, a start date and end date
@@ -38,77 +58,121 @@ def get_series_data_for_the_current_month_btw_start_date_end_date_v2(
         end_date (int): The end date of the range of days.
         month (int): The month of the year.
         year (int): The year.
+        parser_backend (str | None): The parser engine, "lxml" or "bs4" (the reference engine).
 
     Returns:
         list: A list of tuples. Each tuple contains the name of the show, the link to the show and the time of the show.
     """
 
-    print(month, year)
-    soup = BeautifulSoup(page_content, "html.parser")
-    spans = soup.find_all("span")
+    logger.debug("Extracting the series of %d/%d", month, year)
+    parser = get_calendar_parser(parser_backend)
+    extracted_month, extracted_year, day_cells = parser.parse(page_content)
 
     calendar_objects = []
 
-    extracted_month, extracted_year = get_month_year_from_html(soup)
     if month != extracted_month or year != extracted_year:
         raise ValueError(
             f"The month and year in the response header ({extracted_month}, {extracted_year}) do not match the requested month and year ({month}, {year})."
         )
     first_day_of_month = datetime.date(year, month, 1)
 
-    # print(f"{today_date=}")
-
-    for span in spans:
-        if (
-            span.string and span.string.strip().isdigit()
-        ):  # Check if the span contains a number (the day)
-            day = span.string.strip()
-            if start_date <= int(day) <= end_date:
-                day_data_td = span.parent.parent
-                shows = day_data_td.find_all("div", class_="cal_name")
-                if not shows or len(shows) == 0:
-                    # if there are no shows for the day,
-                    continue
-                times = day_data_td.find_all("div", class_="cal_more")
-                day_to_add_to_list = first_day_of_month.replace(day=int(day))
-                day_list = [day_to_add_to_list] * len(shows)
-                # print(f"{day_list=} {shows=} {times=}")
-                # Directly create CalendarDtoPickled objects
-                day_calendar_objects = [
-                    CalendarDtoPickled(
-                        summary=show.find("a")["title"],  # type: ignore
-                        url=_modify_link(show.find("a")["href"]),  # type: ignore
-                        start_time=TIME.find("div", class_="h").text,
-                        start_date=day_date,
-                    )
-                    for show, TIME, day_date in zip(shows, times, day_list)
-                    if not apply_filter(show.find("a")["title"])  # type: ignore
-                ]
-
-                calendar_objects.extend(day_calendar_objects)
+    for day, day_data_td in day_cells:
+        if start_date <= day <= end_date:
+            shows = parser.extract_shows(day_data_td)
+            if not shows:
+                # if there are no shows for the day,
+                continue
+            day_date = first_day_of_month.replace(day=day)
+            # Directly create CalendarDtoPickled objects
+            calendar_objects.extend(
+                CalendarDtoPickled(
+                    summary=title,
+                    url=_modify_link(href),
+                    start_time=time_str,
+                    start_date=day_date,
+                )
+                for title, href, time_str in shows
+                if not apply_filter(title)
+            )
 
     return calendar_objects
 
 
-def apply_filter(show_name: str) -> bool:
-    return filter_series(show_name)
+def get_series_data_for_the_changed_days_of_the_month(
+    page_content: str,
+    month: int,
+    year: int,
+    old_fingerprints: dict[int, str] | None = None,
+    parser_backend: str | None = None,
+) -> tuple[dict[int, list[CalendarDtoPickled]], dict[int, str]]:
+    """
+    Fingerprints every day cell of the calendar page and extracts the series of the days
+    whose fingerprint differs from the one of the last run.
 
+    Args:
+        page_content (str): The page content of the calendar page from next episode.
+        month (int): The month of the year.
+        year (int): The year.
+        old_fingerprints (dict[int, str] | None): The fingerprints of the last run, None to extract every day.
+        parser_backend (str | None): The parser engine, "lxml" or "bs4" (the reference engine).
+
+    Returns:
+        tuple: The series of the changed days as {day: list}, and the fingerprints of every day.
+    """
+    if old_fingerprints is None:
+        old_fingerprints = {}
+
+    with tracing.span("parse", month=month, year=year) as parse_span:
+        parser = get_calendar_parser(parser_backend)
+        extracted_month, extracted_year, day_cells = parser.parse(page_content)
+        if month != extracted_month or year != extracted_year:
+            raise ValueError(
+                f"The month and year in the response header ({extracted_month}, {extracted_year}) do not match the requested month and year ({month}, {year})."
+            )
+
+        changed_day_shows = {}
+        fingerprints: dict[int, str] = {}
+        for day, day_data_td in day_cells:
+            if not 1 <= day <= 31:
+                continue
+            fingerprint = _fingerprint_day(parser.cell_fragment(day_data_td))
+            fingerprints[day] = fingerprint
+            if old_fingerprints.get(day) != fingerprint:
+                changed_day_shows[day] = parser.extract_shows(day_data_td)
+        parse_span.count("days", len(fingerprints))
+        parse_span.count("changed_days", len(changed_day_shows))
+        parse_span.count("shows", sum(len(shows) for shows in changed_day_shows.values()))
+
+    with tracing.span("filter", month=month, year=year) as filter_span:
+        first_day_of_month = datetime.date(year, month, 1)
+        changed_days: dict[int, list[CalendarDtoPickled]] = {}
+        for day, shows in changed_day_shows.items():
+            day_date = first_day_of_month.replace(day=day)
+            changed_days[day] = [
+                CalendarDtoPickled(
+                    summary=title,
+                    url=_modify_link(href),
+                    start_time=time_str,
+                    start_date=day_date,
+                )
+                for title, href, time_str in shows
+                if not apply_filter(title)
+            ]
+            filter_span.count("kept", len(changed_days[day]))
 
-def get_month_year_from_html(soup):
-    select_tag = soup.find("select", {"id": "month"})
-    selected_option = select_tag.find("option", {"selected": True})
-    month_ = selected_option.text.strip()  # Get the text of the selected option
+    return changed_days, fingerprints
 
-    # Step 2: Extract the year
-    year_tag = select_tag.find_next("span")  # Find the adjacent span tag
-    year_ = year_tag.text.strip()  # Get the text of the span tag
 
-    # month [April] and year should be integer
-    month_ = month_.lower()
-    month_ = month_.capitalize()
-    month_ = datetime.datetime.strptime(month_, "%B").month
-    year_ = int(year_)
-    return month_, year_
+def _fingerprint_day(cell_fragment: bytes) -> str:
+    # the filter rules are part of the fingerprint, a rule change re-extracts every day
+    day_hash = hashlib.blake2b(digest_size=16)
+    day_hash.update(get_series_filter_engine().signature.encode())
+    day_hash.update(cell_fragment)
+    return day_hash.hexdigest()
+
+
+def apply_filter(show_name: str) -> bool:
+    return filter_series(show_name)
 
 
 def get_series_for_year(
@@ -116,6 +180,7 @@ def get_series_for_year(
     year: int,
     series_old_data: dict[str, list[CalendarDtoPickled]],
     month_limiter: int = 12,
+    max_concurrency: int = 1,
 ):
     """
     This generator function takes a request session and a year and returns a generator that returns
@@ -129,60 +194,241 @@ def get_series_for_year(
         month_limiter:
         session (requests.session): The requests' session.
         year (int): The year.
+        max_concurrency (int): The number of month pages fetched at the same time.
 
     Yields:
         list: A list of tuples. Each tuple contains the name of the show, the link to the show and the time of the show.
     """
-    base_url = "https://next-episode.net/calendar/"
-
-    start_month, end_month = get_appropriate_month_range(year)
-    end_month = min(end_month, month_limiter)
-
-    for month_loop in range(start_month, end_month + 1):
-        start_time = time.time()
-        response = session.get(base_url, params={"year": year, "month": month_loop})
-        print(f"time taken = {(time.time() - start_time):.2f} seconds")
-        if response.status_code == 200:
-            series_list: list[CalendarDtoPickled] = (
-                get_series_data_for_the_current_month_btw_start_date_end_date_v2(
-                    response.text, 1, 31, month_loop, year
-                )
-            )
-            key: str = f"{month_loop}_{year}"
-
-            sorted_series_list = sorted(
-                series_list,
-                key=lambda x: (
-                    merge_time_str_datetime_date(x.start_time, x.start_date),
-                    x.summary,
-                ),
+    yield from get_series_for_years(
+        session, [(year, month_limiter)], series_old_data, max_concurrency
+    )
+
+
+def get_series_for_years(
+    session: httpx.Client,
+    years: list[tuple[int, int]],
+    series_old_data: dict[str, list[CalendarDtoPickled]],
+    max_concurrency: int = DEFAULT_FETCH_CONCURRENCY,
+    parser_backend: str | None = None,
+    page_cache: CalendarPageCache | None = None,
+    day_fingerprints: dict[str, dict[int, str]] | None = None,
+    refresh_scheduler: MonthRefreshScheduler | None = None,
+):
+    """
+    Fetches the calendar pages of every (year, month) pair concurrently and yields the
+    updated series of each month in month order.
+
+    At most ``max_concurrency`` pages are in flight at once. The pages are still parsed
+    and diffed one after another in month order, so the old series data and
+    NO_LONGER_EXISTING_EVENTS are updated exactly as with a sequential fetch.
+
+    Args:
+        session (httpx.Client): The logged-in client.
+        years (list[tuple[int, int]]): Pairs of (year, month_limiter).
+        series_old_data (dict): The series data of the previous run, updated in place.
+        max_concurrency (int): The number of month pages fetched at the same time.
+        parser_backend (str | None): The calendar page parser engine, None for the default one.
+        page_cache (CalendarPageCache | None): The calendar page cache. Months whose page
+            didn't change since the last run are skipped without parsing and diffing.
+        day_fingerprints (dict | None): The day cell fingerprints of every month, updated in place.
+            Only the days whose cell changed are extracted and diffed.
+        refresh_scheduler (MonthRefreshScheduler | None): Only the months which are due are
+            fetched and yielded, and whether each fetched month changed is recorded.
+
+    Yields:
+        list[CalendarDtoPickled]: The new or updated series of each month.
+    """
+    month_year_pairs = get_month_year_pairs(years)
+    if refresh_scheduler is not None:
+        month_year_pairs = [
+            (month, year)
+            for month, year in month_year_pairs
+            if refresh_scheduler.is_due(month, year, f"{month}_{year}" in series_old_data)
+        ]
+    if not month_year_pairs:
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_concurrency, len(month_year_pairs))),
+        thread_name_prefix="calendar-fetch",
+    ) as executor:
+        # the fetch spans are children of the span the months are fetched in
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                _fetch_month_page,
+                session,
+                month,
+                year,
+                _get_conditional_headers(page_cache, series_old_data, month, year),
             )
+            for month, year in month_year_pairs
+        ]
+        try:
+            for (month, year), future in zip(month_year_pairs, futures):
+                response = future.result()
+                url = _get_calendar_url(month, year)
+                known = f"{month}_{year}" in series_old_data
+                if page_cache is not None and known and page_cache.is_unchanged(url, response):
+                    logger.info("Calendar of %d/%d is unchanged, skipping it", month, year)
+                    if refresh_scheduler is not None:
+                        refresh_scheduler.record(month, year, changed=False)
+                    yield []
+                elif response.status_code == 200:
+                    removed_before = len(NO_LONGER_EXISTING_EVENTS)
+                    with tracing.span("process_month", month=month, year=year):
+                        actual_new_filtered_list = _process_month_page(
+                            response.text,
+                            month,
+                            year,
+                            series_old_data,
+                            parser_backend,
+                            day_fingerprints,
+                        )
+                    if page_cache is not None:
+                        page_cache.store(url, response, month, year)
+                    if refresh_scheduler is not None:
+                        changed = bool(actual_new_filtered_list) or len(NO_LONGER_EXISTING_EVENTS) > removed_before
+                        # the first fetch of a month isn't a change of its contents
+                        refresh_scheduler.record(month, year, changed=known and changed)
+                    yield actual_new_filtered_list
+                else:
+                    yield []
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def get_month_year_pairs(years: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Expands (year, month_limiter) pairs into the ordered (month, year) pairs that need fetching.
 
-            if key not in series_old_data:
-                series_old_data[key] = sorted_series_list
-                actual_new_filtered_list = sorted_series_list
+    Args:
+        years (list[tuple[int, int]]): Pairs of (year, month_limiter).
 
-            else:
-                no_longer_existing = return_no_longer_existing_event_v2(
-                    series_old_data[key], sorted_series_list
-                )
+    Returns:
+        list[tuple[int, int]]: The (month, year) pairs in calendar order.
+    """
+    month_year_pairs = []
+    for year, month_limiter in years:
+        start_month, end_month = get_appropriate_month_range(year)
+        end_month = min(end_month, month_limiter)
+        month_year_pairs.extend(
+            (month, year) for month in range(start_month, end_month + 1)
+        )
+    return month_year_pairs
 
-                actual_new_filtered_list = (
-                    return_new_list_of_series_which_actually_is_updated_v2(
-                        sorted_series_list, series_old_data[key]
-                    )
-                )
-                if len(no_longer_existing) > 0:
-                    NO_LONGER_EXISTING_EVENTS.extend(no_longer_existing)
 
-                series_old_data[key] = fill_new_series_list_calendar_ids(
-                    series_old_data, key, sorted_series_list
-                )
+def _get_calendar_url(month: int, year: int) -> str:
+    return f"{BASE_URL}?year={year}&month={month}"
+
 
-            yield actual_new_filtered_list
+def _get_conditional_headers(
+    page_cache: CalendarPageCache | None,
+    series_old_data: dict[str, list[CalendarDtoPickled]],
+    month: int,
+    year: int,
+) -> dict[str, str]:
+    # a 304 is only useful if the month of the last run is still there
+    if page_cache is None or f"{month}_{year}" not in series_old_data:
+        return {}
+    return page_cache.conditional_headers(_get_calendar_url(month, year))
+
+
+def _fetch_month_page(
+    session: httpx.Client, month: int, year: int, headers: dict[str, str]
+) -> httpx.Response:
+    with tracing.span("fetch_month", month=month, year=year) as span:
+        response = session.get(_get_calendar_url(month, year), headers=headers)
+        span.set(status=response.status_code)
+        span.count("bytes", len(response.content))
+    return response
+
+
+def _process_month_page(
+    page_content: str,
+    month: int,
+    year: int,
+    series_old_data: dict[str, list[CalendarDtoPickled]],
+    parser_backend: str | None = None,
+    day_fingerprints: dict[str, dict[int, str]] | None = None,
+) -> list[CalendarDtoPickled]:
+    """
+    Parses a month page, stores the sorted month in series_old_data and returns the
+    series which are new or updated since the last run.
 
-        else:
-            yield []
+    With day_fingerprints only the days whose cell changed since the last run are extracted,
+    sorted and diffed, the series of the other days are taken over from series_old_data.
+    """
+    key: str = f"{month}_{year}"
+    old_series_list = series_old_data.get(key)
+
+    old_fingerprints = None
+    if day_fingerprints is not None and old_series_list is not None:
+        old_fingerprints = day_fingerprints.get(key)
+
+    changed_days, fingerprints = get_series_data_for_the_changed_days_of_the_month(
+        page_content, month, year, old_fingerprints, parser_backend
+    )
+    if day_fingerprints is not None:
+        day_fingerprints[key] = fingerprints
+
+    unchanged_days = set()
+    if old_fingerprints is not None:
+        unchanged_days = {
+            day
+            for day, fingerprint in fingerprints.items()
+            if old_fingerprints.get(day) == fingerprint
+        }
+
+    old_series_by_day: dict[int, list[CalendarDtoPickled]] = {}
+    for event in old_series_list or []:
+        old_series_by_day.setdefault(event.start_date.day, []).append(event)
+
+    # the month stays sorted by (date and time, summary) if every day is sorted on its own
+    sorted_series_list: list[CalendarDtoPickled] = []
+    changed_series_list: list[CalendarDtoPickled] = []
+    with tracing.span("sort", month=month, year=year) as sort_span:
+        for day in sorted(old_series_by_day.keys() | changed_days.keys()):
+            if day in unchanged_days:
+                sorted_series_list.extend(old_series_by_day.get(day, []))
+                continue
+            sorted_day_list = sorted(
+                changed_days.get(day, []),
+                key=lambda x: (get_event_start_end(x.start_time, x.start_date)[0], x.summary),
+            )
+            sorted_series_list.extend(sorted_day_list)
+            changed_series_list.extend(sorted_day_list)
+        sort_span.count("sorted", len(changed_series_list))
+
+    if old_series_list is None:
+        series_old_data[key] = sorted_series_list
+        return sorted_series_list
+
+    # the events of the unchanged days are in both lists, so only the changed days are diffed
+    old_changed_series_list = [
+        event for event in old_series_list if event.start_date.day not in unchanged_days
+    ]
+
+    # titles of the unchanged days still exist, an event which moved there isn't removed
+    with tracing.span("diff", month=month, year=year) as diff_span:
+        month_diff = diff_month_events(
+            old_changed_series_list,
+            changed_series_list,
+            [
+                event
+                for day in unchanged_days
+                for event in old_series_by_day.get(day, [])
+            ],
+        )
+        diff_span.count("updated", len(month_diff.updated))
+        diff_span.count("removed", len(month_diff.removed))
+    if len(month_diff.removed) > 0:
+        NO_LONGER_EXISTING_EVENTS.extend(month_diff.removed)
+
+    series_old_data[key] = sorted_series_list
+
+    return month_diff.updated
 
 
 def get_appropriate_month_range(year) -> tuple[int, int]:
@@ -211,8 +457,25 @@ def get_appropriate_month_range(year) -> tuple[int, int]:
     return start_month, end_month
 
 
+def set_next_episode_url(url: str):
+    """
+    Redirects the calendar pages and the show links of the calendar to another next-episode
+    host, e.g. the local stand-in of the load test.
+
+    Args:
+        url (str): The scheme and host of the site, e.g. "http://127.0.0.1:8080".
+    """
+    global BASE_URL, _link_base
+    parts = urlsplit(url)
+    BASE_URL = f"{parts.scheme}://{parts.netloc}{parts.path.rstrip('/')}/calendar/"
+    _link_base = (parts.scheme, parts.netloc)
+
+
 def _modify_link(link: str) -> str:
-    return f"https:{link}"
+    if _link_base is None:
+        return f"https:{link}"
+    parts = urlsplit(link)
+    return urlunsplit((*_link_base, parts.path, parts.query, parts.fragment))
 
 
 # not being used don't use it for now
@@ -300,7 +563,7 @@ def get_series_data_for_the_current_month_btw_start_date_end_date(
         list: A list of tuples. Each tuple contains the name of the show,
         the link to the show and the time of the show.
     """
-    print(start_date, end_date)
+    logger.debug("Extracting the series of days %s to %s", start_date, end_date)
     soup = BeautifulSoup(page_content, "html.parser")
     spans = soup.find_all("span")
     series_data = []
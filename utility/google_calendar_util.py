@@ -3,17 +3,21 @@ This module contains utility functions for adding events to Google Calendar.
 """
 
 import datetime
+import functools
 from logging import getLogger
 
 from common_dto.events import CalendarDtoPickled
-from gdrive_tool import my_google_calendar
 import pytz
 
+from .calendar_batch import DELETE, INSERT, CalendarOperation, execute_in_batches
+from .calendar_session import CalendarSession
+from .time_utility import CALENDAR_TIME_ZONE, get_events_start_end
+
 logger = getLogger(__name__)
 
 I_M_P = "%I:%M%p"
 
-TI = "Asia/Kolkata"
+TI = CALENDAR_TIME_ZONE
 
 
 def _add_event_to_google_calendar(
@@ -23,6 +27,7 @@ def _add_event_to_google_calendar(
     series_description: str,
     image_url: str | None = None,
     event_id: str | None = None,
+    calendar_session: CalendarSession | None = None,
 ):
     """
     This function adds an event to Google Calendar.
@@ -33,9 +38,12 @@ def _add_event_to_google_calendar(
         start_time (datetime.datetime): The start time of the event.
         end_time (datetime.datetime): The end time of the event.
         series_description (str): The description of the series.
+        calendar_session (CalendarSession | None): The session whose client is used, a new client if None.
     """
-    google_calendar = my_google_calendar.GoogleCalendar()
-    calendar_id: str | None = google_calendar.create_event_v2(
+    if calendar_session is None:
+        calendar_session = CalendarSession()
+    calendar_id: str | None = calendar_session.call(
+        "create_event_v2",
         summary=series_name,
         description=series_description,
         image_url=image_url,
@@ -163,7 +171,10 @@ def add_event_for_current_month(series_list: list):
 
 
 def add_event_from_data_series_v2(
-    series_list: list[CalendarDtoPickled], image_mapping: dict | None
+    series_list: list[CalendarDtoPickled],
+    image_mapping: dict | None,
+    batch_size: int | None = None,
+    calendar_session: CalendarSession | None = None,
 ):
     """
     This function adds an event to Google Calendar for each series in the series_list.
@@ -178,46 +189,143 @@ def add_event_from_data_series_v2(
         Each tuple contains the name of the series,
         the link to the series and the time of the show
         and the day of the month.
+        batch_size (int | None): Writes the events in batch requests of this size, one by one if None.
+        calendar_session (CalendarSession | None): The run's calendar session, a new one if None.
     """
-    for series in series_list:
-        summary = series.summary
-        description = "Series"
-        time_str = series.start_time
-        day: datetime.date = series.start_date
+    if calendar_session is None:
+        calendar_session = CalendarSession()
 
-        # parse 7:30pm today to datetime object using pytz and datetime
-        date_time_series = datetime.datetime.strptime(time_str, I_M_P)
-        combined_datetime = datetime.datetime.combine(day, date_time_series.time())
-        start_time = pytz.timezone(TI).localize(
-            combined_datetime + datetime.timedelta(hours=1)
-        )
-        end_time = start_time + datetime.timedelta(hours=1)
-        # print(summary,start_time,end_time,description)
-        image_url = ""
-        if image_mapping is not None and series.url in image_mapping:
-            image_url = image_mapping[series.url]
+    # the start and end of the whole list are converted at once
+    start_end_times = get_events_start_end(series_list, TI)
 
-        calendar_id: str | None = _add_event_to_google_calendar(
-            summary, start_time, end_time, description, image_url, series.calendar_id
+    if batch_size is not None:
+        operations = [
+            CalendarOperation(
+                INSERT,
+                series,
+                "Series",
+                start_time,
+                end_time,
+                _get_image_url(series, image_mapping),
+                TI,
+            )
+            for series, (start_time, end_time) in zip(series_list, start_end_times)
+        ]
+        execute_in_batches(
+            calendar_session,
+            operations,
+            functools.partial(_execute_single_operation, calendar_session),
+            batch_size,
         )
+        return
+
+    calendar_ids = calendar_session.map(
+        functools.partial(
+            _add_series_event, image_mapping=image_mapping, calendar_session=calendar_session
+        ),
+        list(zip(series_list, start_end_times)),
+    )
+    # written back in the order of the series list
+    for series, calendar_id in zip(series_list, calendar_ids):
         series.calendar_id = calendar_id
 
 
+def _add_series_event(
+    series_start_end: tuple[
+        CalendarDtoPickled, tuple[datetime.datetime, datetime.datetime]
+    ],
+    image_mapping: dict | None,
+    calendar_session: CalendarSession,
+) -> str | None:
+    series, (start_time, end_time) = series_start_end
+    summary = series.summary
+    description = "Series"
+    image_url = _get_image_url(series, image_mapping)
+
+    return _add_event_to_google_calendar(
+        summary,
+        start_time,
+        end_time,
+        description,
+        image_url,
+        series.calendar_id,
+        calendar_session,
+    )
+
+
+def _get_image_url(series: CalendarDtoPickled, image_mapping: dict | None) -> str:
+    image_url = ""
+    if image_mapping is not None and series.url in image_mapping:
+        image_url = image_mapping[series.url]
+    return image_url
+
+
+def _delete_event_from_google_calendar(
+    event: CalendarDtoPickled, image_url: str | None, calendar_session: CalendarSession
+):
+    # the client cleans up the poster attached to the event
+    calendar_session.call(
+        "delete_event",
+        event_id=event.calendar_id,
+        image_url=image_url,
+        summary=event.summary,
+    )
+
+
+def _execute_single_operation(
+    calendar_session: CalendarSession, operation: CalendarOperation
+):
+    """Executes a batch operation through the regular one-event-per-call path."""
+    if operation.kind == DELETE:
+        _delete_event_from_google_calendar(
+            operation.event, operation.image_url, calendar_session
+        )
+        return
+
+    operation.event.calendar_id = _add_event_to_google_calendar(
+        operation.event.summary,
+        operation.start_time,
+        operation.end_time,
+        operation.description,
+        operation.image_url,
+        operation.event.calendar_id,
+        calendar_session,
+    )
+
+
 def delete_no_longer_existing_events_v2(
-    series_list_to_delete: list[CalendarDtoPickled], image_mapping: dict | None
+    series_list_to_delete: list[CalendarDtoPickled],
+    image_mapping: dict | None,
+    batch_size: int | None = None,
+    calendar_session: CalendarSession | None = None,
 ):
     """
     This function deletes events from Google Calendar that are no longer existing.
     The events to be deleted are stored in the NO_LONGER_EXISTING_EVENTS list.
+    With batch_size the deletes are sent in batch requests of this size.
     """
     if image_mapping is None:
         image_mapping = {}
-    google_calendar = my_google_calendar.GoogleCalendar()
-    for event in series_list_to_delete:
-        if event.calendar_id is None:
-            continue
-        google_calendar.delete_event(
-            event_id=event.calendar_id,
-            image_url=image_mapping[event.url],
-            summary=event.summary,
+    if calendar_session is None:
+        calendar_session = CalendarSession()
+
+    if batch_size is not None:
+        operations = [
+            CalendarOperation(DELETE, event, image_url=image_mapping.get(event.url))
+            for event in series_list_to_delete
+            if event.calendar_id is not None
+        ]
+        execute_in_batches(
+            calendar_session,
+            operations,
+            functools.partial(_execute_single_operation, calendar_session),
+            batch_size,
         )
+        return
+
+    calendar_session.map(
+        lambda event: _delete_event_from_google_calendar(
+            event, image_mapping.get(event.url), calendar_session
+        ),
+        [event for event in series_list_to_delete if event.calendar_id is not None],
+    )
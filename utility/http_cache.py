@@ -0,0 +1,166 @@
+"""
+This module contains a persistent cache for the calendar pages of next episode.
+
+For every calendar URL the cache keeps the ETag, the Last-Modified header, the size and a hash
+of the last body. The next request of that URL is sent as a conditional GET, and a page which
+the server answers with 304, or whose body hash didn't change, doesn't need to be parsed
+and diffed again. Entries stored with a different signature (e.g. other filter rules)
+are treated as missing, because the page would now be parsed into a different result.
+"""
+
+import hashlib
+import logging
+import pickle
+
+import httpx
+
+from .pickle_utility import get_data_directory
+from .time_utility import get_current_month, get_current_year
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_PAGE_CACHE = "calendar_page_cache.pickle"
+
+
+class CalendarPageCache:
+    """
+    Keeps the validators and body hashes of the calendar pages between runs,
+    and counts the hits, misses and bytes saved of the current run.
+    """
+
+    def __init__(self, file=None, signature: str = ""):
+        self._file = file or get_data_directory().joinpath(CALENDAR_PAGE_CACHE)
+        self._signature = signature
+        self._entries: dict[str, dict] = self._load()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Resets the counters, the next ones belong to a new run.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _load(self) -> dict[str, dict]:
+        if not self._file.exists():
+            return {}
+        with open(self._file, "rb") as file:
+            try:
+                return pickle.load(file)
+            except Exception as e:
+                logger.warning("Failed to load the calendar page cache: %s", e)
+                return {}
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """
+        Returns the If-None-Match / If-Modified-Since headers for the URL.
+
+        Parameters
+        ----------
+        url : str
+            The calendar URL
+
+        Returns
+        -------
+        dict
+            The conditional request headers, empty if the URL isn't cached
+        """
+        entry = self._get_entry(url)
+        if entry is None:
+            return {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_unchanged(self, url: str, response: httpx.Response) -> bool:
+        """
+        Checks whether the page is the same as the one of the last run and counts the hits.
+
+        Parameters
+        ----------
+        url : str
+            The calendar URL
+        response : httpx.Response
+            The response of the (conditional) request
+
+        Returns
+        -------
+        bool
+            True if the server answered 304 or the body hash matches the cached one
+        """
+        entry = self._get_entry(url)
+        if entry is not None:
+            if response.status_code == 304:
+                self.hits += 1
+                self.bytes_saved += entry.get("size", 0)
+                return True
+            if response.status_code == 200 and entry.get("body_hash") == _hash_body(response.content):
+                self.hits += 1
+                return True
+        return False
+
+    def store(self, url: str, response: httpx.Response, month: int, year: int):
+        """
+        Stores the validators and the body hash of a page which was parsed successfully,
+        every stored page counts as a miss.
+
+        Parameters
+        ----------
+        url : str
+            The calendar URL
+        response : httpx.Response
+            The 200 response of the request
+        month : int
+            The month of the page
+        year : int
+            The year of the page
+        """
+        self.misses += 1
+        self._entries[url] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body_hash": _hash_body(response.content),
+            "size": len(response.content),
+            "month": month,
+            "year": year,
+            "signature": self._signature,
+        }
+
+    def _get_entry(self, url: str) -> dict | None:
+        entry = self._entries.get(url)
+        if entry is None or entry.get("signature", "") != self._signature:
+            return None
+        return entry
+
+    def save(self):
+        """
+        Saves the cache to disk, without the pages of the previous months.
+        """
+        current_year = get_current_year()
+        current_month = get_current_month()
+        self._entries = {
+            url: entry
+            for url, entry in self._entries.items()
+            if (entry["year"], entry["month"]) >= (current_year, current_month)
+        }
+        with open(self._file, "wb") as file:
+            pickle.dump(self._entries, file)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the hit, miss and bytes saved counters of the current run.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+def _hash_body(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,289 @@
+"""
+This module contains the record and replay mode of the HTTP exchanges of a run.
+
+In record mode every request of the httpx clients (the calendar pages, the show pages and
+the posters) and every call of the calendar client is passed through and captured into a
+fixture archive, data/http_fixtures.pickle by default. In replay mode the archive serves them
+back without touching the network, optionally after a latency injected per host, so whole
+runs can be timed offline. Both modes work on a scratch copy of data/ and images/ (see
+pickle_utility.scratch_state_directories), so a replayed run is deterministic as long as the
+real data/ didn't change since the recording.
+
+The calendar calls are never sent, not even when recording: the ids of the events written to
+the real calendar would only be kept in the scratch state, and the next real run would write
+them again. The recorded calendar answers with made-up event ids, the injected latency stands
+in for the API. The calls are recorded one event at a time, the proxies don't expose the
+service which the batch requests need.
+"""
+
+import asyncio
+from collections import defaultdict
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+
+import httpx
+
+from .pickle_utility import DATA_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+# kept with the real state, the runs of the http modes work on a copy of it
+HTTP_FIXTURES = DATA_DIRECTORY.joinpath("http_fixtures.pickle")
+
+RECORD = "record"
+REPLAY = "replay"
+HTTP_MODES = (RECORD, REPLAY)
+
+# the latency key of the calendar client calls
+CALENDAR_HOST = "calendar"
+
+
+class HttpFixtures:
+    """
+    The fixture archive of a run and the transports and calendar clients which record into it
+    or replay from it.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        path=HTTP_FIXTURES,
+        latency: dict[str, float] | None = None,
+    ):
+        """
+        Args:
+            mode (str): "record" or "replay".
+            path (Path): The fixture archive.
+            latency (dict[str, float] | None): The seconds added to every replayed exchange
+                per host, "calendar" for the calendar client.
+        """
+        if mode not in HTTP_MODES:
+            raise ValueError(f"Unknown http mode {mode!r}, expected one of {HTTP_MODES}")
+        self.mode = mode
+        self.path = path
+        self.latency = latency or {}
+        self._lock = threading.Lock()
+        # key -> the recorded exchanges in order, and the next one to replay
+        self._exchanges: dict[str, list] = defaultdict(list)
+        self._replayed: dict[str, int] = defaultdict(int)
+        if mode == REPLAY:
+            with open(path, "rb") as file:
+                self._exchanges.update(pickle.load(file))
+            logger.info("Replaying %d recorded exchanges from %s", len(self._exchanges), path)
+
+    def transport(self) -> httpx.BaseTransport:
+        """Returns the transport of an httpx.Client."""
+        if self.mode == RECORD:
+            return RecordingTransport(self, httpx.HTTPTransport(http2=True))
+        return ReplayTransport(self)
+
+    def async_transport(self) -> httpx.AsyncBaseTransport:
+        """Returns the transport of an httpx.AsyncClient."""
+        if self.mode == RECORD:
+            return AsyncRecordingTransport(self, httpx.AsyncHTTPTransport(http2=True))
+        return AsyncReplayTransport(self)
+
+    def calendar_client(self):
+        """Returns a calendar client for the CalendarSession, it doesn't touch the real calendar."""
+        if self.mode == RECORD:
+            return RecordingCalendarClient(self)
+        return ReplayCalendarClient(self)
+
+    def save(self):
+        """Writes the archive when recording, readable by the owner only."""
+        if self.mode != RECORD:
+            return
+        # the archive has the login form, the session cookies and the calendar responses
+        with self._lock, open(
+            os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb"
+        ) as file:
+            os.fchmod(file.fileno(), 0o600)
+            pickle.dump(dict(self._exchanges), file)
+        logger.info("Recorded %d exchanges to %s", len(self._exchanges), self.path)
+
+    def record(self, key: str, exchange):
+        with self._lock:
+            self._exchanges[key].append(exchange)
+
+    def replay(self, key: str):
+        """
+        Returns the next recorded exchange of the key, the last one again once they're used up,
+        None if the key wasn't recorded.
+        """
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                return None
+            index = min(self._replayed[key], len(exchanges) - 1)
+            self._replayed[key] += 1
+            return exchanges[index]
+
+    def get_latency(self, host: str) -> float:
+        return self.latency.get(host, 0.0)
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, fixtures: HttpFixtures, transport: httpx.BaseTransport):
+        self._fixtures = fixtures
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self._transport.handle_request(request)
+        content = response.read()
+        response.close()
+        return _record_response(self._fixtures, request, response, content)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, fixtures: HttpFixtures, transport: httpx.AsyncBaseTransport):
+        self._fixtures = fixtures
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        content = await response.aread()
+        await response.aclose()
+        return _record_response(self._fixtures, request, response, content)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, fixtures: HttpFixtures):
+        self._fixtures = fixtures
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        time.sleep(self._fixtures.get_latency(request.url.host))
+        return _replay_response(self._fixtures, request)
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, fixtures: HttpFixtures):
+        self._fixtures = fixtures
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self._fixtures.get_latency(request.url.host))
+        return _replay_response(self._fixtures, request)
+
+
+class RecordingCalendarClient:
+    """
+    Answers the calls of the calendar client like a dry run, the created events get made-up
+    ids, and records the results.
+    """
+
+    def __init__(self, fixtures: HttpFixtures):
+        self._fixtures = fixtures
+
+    def __getattr__(self, name: str):
+        # without the service the batch requests fall back to one call per event
+        if name.startswith("_") or name == "service":
+            raise AttributeError(name)
+
+        def call(**kwargs):
+            result = None
+            if name == "create_event_v2":
+                result = kwargs.get("event_id") or f"recorded{uuid.uuid4().hex}"
+            self._fixtures.record(_get_calendar_key(name, kwargs), result)
+            return result
+
+        return call
+
+
+class ReplayCalendarClient:
+    """
+    Answers the calls of the calendar client with the recorded results.
+    """
+
+    def __init__(self, fixtures: HttpFixtures):
+        self._fixtures = fixtures
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or name == "service":
+            raise AttributeError(name)
+
+        def call(**kwargs):
+            time.sleep(self._fixtures.get_latency(CALENDAR_HOST))
+            return self._fixtures.replay(_get_calendar_key(name, kwargs))
+
+        return call
+
+
+def parse_latency(value: str | None) -> dict[str, float]:
+    """
+    Parses the latency per host of a setting like "next-episode.net=0.2,calendar=0.1".
+    """
+    latency = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            host, seconds = item.split("=", 1)
+            latency[host.strip()] = float(seconds)
+    return latency
+
+
+def _get_http_key(request: httpx.Request) -> str:
+    return f"{request.method} {request.url}"
+
+
+def _get_calendar_key(name: str, kwargs: dict) -> str:
+    # the calls of the concurrent writers are matched by their event, not by their order
+    return " ".join(
+        str(part)
+        for part in (
+            CALENDAR_HOST,
+            name,
+            kwargs.get("summary"),
+            kwargs.get("start_time"),
+            kwargs.get("event_id"),
+        )
+    )
+
+
+def _record_response(
+    fixtures: HttpFixtures,
+    request: httpx.Request,
+    response: httpx.Response,
+    content: bytes,
+) -> httpx.Response:
+    headers = [
+        (name, value)
+        for name, value in response.headers.multi_items()
+        # the content is stored decoded
+        if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+    ]
+    fixtures.record(_get_http_key(request), (response.status_code, headers, content))
+    return httpx.Response(
+        response.status_code,
+        headers=headers,
+        content=content,
+        request=request,
+        extensions={"http_version": response.extensions.get("http_version", b"HTTP/1.1")},
+    )
+
+
+def _replay_response(fixtures: HttpFixtures, request: httpx.Request) -> httpx.Response:
+    exchange = fixtures.replay(_get_http_key(request))
+    if exchange is None:
+        logger.warning("No recorded exchange for %s %s", request.method, request.url)
+        return httpx.Response(404, request=request)
+    status_code, headers, content = exchange
+    return httpx.Response(status_code, headers=headers, content=content, request=request)
+
+
+def get_http_fixtures(
+    mode: str | None, path=None, latency: str | None = None
+) -> HttpFixtures | None:
+    """
+    Returns the fixtures of the http mode, None when the run talks to the live endpoints.
+    """
+    if not mode:
+        return None
+    return HttpFixtures(mode, path or HTTP_FIXTURES, parse_latency(latency))
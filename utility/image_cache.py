@@ -0,0 +1,160 @@
+"""
+This module contains the garbage collector of the images/ directory.
+
+The images are kept within a byte and a file budget. When the directory is over budget the
+images whose shows aired the longest time ago are evicted first, and files which no entry
+of the series-to-image mapping points to are swept. The collection runs once at the end
+of a run, after the mapping was cleaned, instead of while the mapping is loaded.
+"""
+
+from collections.abc import Iterable
+import logging
+import os
+from pathlib import Path
+import time
+
+from .pickle_utility import get_image_directory
+from .state_store import SeriesStateStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_FILES = 10_000
+# downloads which were interrupted leave their temporary file behind
+STALE_PART_FILE_AGE = 60 * 60
+
+
+class ImageCacheManager:
+    """
+    Keeps images/ within its budgets and sweeps the files which aren't mapped anymore.
+    """
+
+    def __init__(
+        self,
+        root: Path | None = None,
+        max_bytes: int | None = DEFAULT_MAX_BYTES,
+        max_files: int | None = DEFAULT_MAX_FILES,
+    ):
+        self.root = root or get_image_directory()
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._state_store = SeriesStateStore()
+        self.orphans_removed = 0
+        self.evicted = 0
+        self.bytes_freed = 0
+
+    def collect(
+        self,
+        image_mapping: dict[str, str],
+        stale_urls: Iterable[str] = (),
+        sweep_orphans: bool = True,
+    ) -> set[str]:
+        """
+        Removes the orphaned files and evicts the least recently aired images until
+        the directory is within budget. The orphans aren't swept if the mapping is empty,
+        an empty mapping would make every image an orphan.
+
+        Parameters
+        ----------
+        image_mapping : dict[str, str]
+            The series url -> image path mapping of the run.
+        stale_urls : Iterable[str]
+            The series urls whose entries are removed from the mapping on save.
+        sweep_orphans : bool
+            Whether the files which aren't mapped are removed, False if the mapping
+            failed to load.
+
+        Returns
+        -------
+        set[str]
+            The series urls whose images were evicted, their entries have to be removed
+            from the mapping as well. Their images are downloaded again the next time
+            their events are written.
+        """
+        stale_urls = set(stale_urls)
+        referenced: dict[Path, set[str]] = {}
+        for url, image_path in image_mapping.items():
+            if url not in stale_urls:
+                referenced.setdefault(_normalize(image_path), set()).add(url)
+
+        files = self._list_files()
+        if sweep_orphans and image_mapping:
+            for path in files.keys() - referenced.keys():
+                self._remove(path, files[path])
+                self.orphans_removed += 1
+        elif files:
+            logger.warning(
+                "The image mapping is empty or failed to load, not sweeping the %d images",
+                len(files),
+            )
+
+        evicted_urls = self._evict(
+            {path: files[path] for path in referenced.keys() & files.keys()}, referenced
+        )
+        logger.info("Image cache: %s", self.stats())
+        return evicted_urls
+
+    def stats(self) -> dict:
+        return {
+            "orphans_removed": self.orphans_removed,
+            "evicted": self.evicted,
+            "bytes_freed": self.bytes_freed,
+        }
+
+    def _evict(
+        self, files: dict[Path, int], referenced: dict[Path, set[str]]
+    ) -> set[str]:
+        total_bytes = sum(files.values())
+        total_files = len(files)
+        if not self._is_over_budget(total_bytes, total_files):
+            return set()
+
+        last_air_dates = self._state_store.get_last_air_dates()
+
+        def last_referenced(path: Path) -> str:
+            # images of shows which aren't in the series data anymore go first
+            return max(
+                (last_air_dates.get(url, "") for url in referenced[path]), default=""
+            )
+
+        evicted_urls = set()
+        for path in sorted(files, key=lambda path: (last_referenced(path), path.name)):
+            if not self._is_over_budget(total_bytes, total_files):
+                break
+            self._remove(path, files[path])
+            self.evicted += 1
+            total_bytes -= files[path]
+            total_files -= 1
+            evicted_urls |= referenced[path]
+        return evicted_urls
+
+    def _is_over_budget(self, total_bytes: int, total_files: int) -> bool:
+        return (self.max_bytes is not None and total_bytes > self.max_bytes) or (
+            self.max_files is not None and total_files > self.max_files
+        )
+
+    def _list_files(self) -> dict[Path, int]:
+        files = {}
+        now = time.time()
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                # the temporary files of downloads which are still running are kept
+                if entry.name.startswith(".") and now - stat.st_mtime < STALE_PART_FILE_AGE:
+                    continue
+                files[_normalize(entry.path)] = stat.st_size
+        return files
+
+    def _remove(self, path: Path, size: int):
+        try:
+            os.remove(path)
+            self.bytes_freed += size
+            logger.debug("Removed image %s", path.name)
+        except OSError as e:
+            logger.debug("Failed to delete %s: %s", path, e)
+
+
+def _normalize(image_path) -> Path:
+    return Path(image_path).resolve()
@@ -0,0 +1,103 @@
+"""
+This module contains the content-addressed store of the anime images.
+
+Every image is kept once under images/ as <sha256><suffix>, whatever name the poster was
+served under, and the poster url it was downloaded from is remembered in the state store.
+Shows which share a poster map to the same file, so the file is only removed once no
+mapping entry refers to it anymore.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from .pickle_utility import get_image_directory
+from .state_store import SeriesStateStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUFFIX = ".jpg"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ContentAddressedImageStore:
+    """
+    Keeps the downloaded images by the SHA-256 of their content.
+    """
+
+    def __init__(self, root: Path | None = None):
+        self.root = root or get_image_directory()
+        self.root.mkdir(exist_ok=True)
+        self._state_store = SeriesStateStore()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.added = 0
+            self.deduplicated = 0
+            self.bytes_saved = 0
+
+    def get_image_for_source(self, src_url: str) -> Path | None:
+        """
+        Returns the stored image downloaded from the poster url, None if there's none on disk.
+        """
+        image_path = self._state_store.get_image_source(src_url)
+        if image_path is None or not os.path.exists(image_path):
+            return None
+        return Path(image_path)
+
+    async def add(self, temp_path: Path, src_url: str) -> tuple[Path, bool]:
+        """
+        Moves a downloaded image into the store, hashing it on a worker thread so the
+        event loop keeps downloading. If an image with the same content is already stored
+        the download is dropped and the existing file is returned.
+
+        Args:
+            temp_path (Path): The completely written download.
+            src_url (str): The poster url the image was downloaded from.
+
+        Returns:
+            tuple[Path, bool]: The path of the stored image and whether the download was stored
+                as a new image.
+        """
+        return await asyncio.to_thread(self._add, temp_path, src_url)
+
+    def _add(self, temp_path: Path, src_url: str) -> tuple[Path, bool]:
+        digest = _hash_file(temp_path)
+        suffix = Path(urlsplit(src_url).path).suffix.lower() or DEFAULT_SUFFIX
+        image_path = self.root.joinpath(digest + suffix)
+
+        stored = not image_path.exists()
+        if not stored:
+            with self._lock:
+                self.deduplicated += 1
+                self.bytes_saved += temp_path.stat().st_size
+            os.remove(temp_path)
+            logger.debug("Image of %s is already stored as %s", src_url, image_path.name)
+        else:
+            os.replace(temp_path, image_path)
+            with self._lock:
+                self.added += 1
+
+        self._state_store.save_image_source(src_url, str(image_path))
+        return image_path, stored
+
+    def stats(self) -> dict:
+        return {
+            "added": self.added,
+            "deduplicated": self.deduplicated,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+def _hash_file(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
@@ -1,26 +1,262 @@
 """
 This module contains functions for logging into a website.
+
+The cookies of the logged-in client are saved to data/next_episode_cookies.pickle and loaded
+again by the next run, which reuses them without checking them first: when the site sends
+a request of the reused session to the login page the client logs in again and sends the
+request again. Only the cookies of a confirmed login or reuse are saved, the site sets a
+session cookie for anonymous visitors too, so an unexpired cookie alone doesn't mean a
+logged-in session.
 """
 
+from collections.abc import Callable
+from http.cookiejar import Cookie
+import logging
+import os
+import pickle
+import threading
+import time
+from urllib.parse import urlsplit
+import weakref
+
 import httpx
 
+from .pickle_utility import get_data_directory
+
+logger = logging.getLogger(__name__)
+
+COOKIE_JAR = "next_episode_cookies.pickle"
+
+# the clients whose session was confirmed by a login or by a page served to the session
+_logged_in_clients: weakref.WeakSet[httpx.Client] = weakref.WeakSet()
+
 
-def login_user_httpx(username: str, password: str, login_url: str) -> httpx.Client:
+class SessionClient(httpx.Client):
+    """
+    A client which logs in again when the site sends one of its requests to the login page,
+    and sends the request again with the new session. A failed login isn't tried again.
+    """
+
+    def __init__(
+        self, login: Callable[["SessionClient"], bool], login_url: str, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self._login = login
+        self._login_url = httpx.URL(login_url)
+        self._login_lock = threading.Lock()
+        # counts the logins, the requests sent before the last one don't log in again
+        self._logins = 0
+        self._login_failed = False
+
+    def log_in(self) -> bool:
+        """Logs in with a new session."""
+        with self._login_lock:
+            return self._log_in()
+
+    def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        logins = self._logins
+        response = super().send(request, **kwargs)
+        if request.url == self._login_url:
+            return response
+        if not _is_login_redirect(response):
+            if response.is_success and self.cookies and not self._login_failed:
+                _logged_in_clients.add(self)
+            return response
+
+        with self._login_lock:
+            if self._login_failed:
+                return response
+            if logins == self._logins and not self._log_in():
+                return response
+        response.close()
+        logger.info("Sending %s again with the new next-episode session", request.url)
+        # the cookies are added when the request is built
+        headers = [
+            (name, value)
+            for name, value in request.headers.multi_items()
+            if name.lower() != "cookie"
+        ]
+        request = self.build_request(
+            request.method, request.url, headers=headers, content=request.content or None
+        )
+        return super().send(request, **kwargs)
+
+    def _log_in(self) -> bool:
+        _logged_in_clients.discard(self)
+        self._logins += 1
+        self._login_failed = not self._login(self)
+        return not self._login_failed
+
+
+def login_user_httpx(
+    username: str,
+    password: str,
+    login_url: str,
+    cookie_file=None,
+    transport: httpx.BaseTransport | None = None,
+    session_cookie: str | None = None,
+) -> httpx.Client:
     """
     Logs into a website using the provided username and password and returns an authenticated httpx client.
+    The saved session is reused without logging in again, the client logs in when the site
+    sends a request of the reused session to the login page.
 
     Args:
         username (str): The username for logging in.
         password (str): The password for logging in.
         login_url (str): The URL to send the login request to.
+        cookie_file (Path | None): The file the cookies are saved to, in the data directory if None.
+        transport (httpx.BaseTransport | None): The transport of the client, e.g. to record or replay.
+        session_cookie (str | None): The name of the session cookie, any cookie of the site if None.
 
     Returns:
-        httpx.Client: An authenticated client if the login is successful.
+        httpx.Client: An authenticated client if the login is successful, see is_logged_in.
     """
-    client = httpx.Client(timeout=10.0, http2=True)
-    print("trying to login")
+    cookie_file = cookie_file or get_data_directory().joinpath(COOKIE_JAR)
+
+    def login(client: httpx.Client) -> bool:
+        client.cookies.clear()
+        logger.info("trying to login")
+        response = client.post(
+            login_url, data={"username": username, "password": password}, timeout=10
+        )
+        if not _is_login_successful(response, client, login_url, session_cookie):
+            logger.error(
+                "Login to %s failed with status %d, the calendar is fetched logged out",
+                login_url,
+                response.status_code,
+            )
+            return False
+        _logged_in_clients.add(client)
+        save_session_cookies(client, cookie_file)
+        return True
 
-    client.post(
-        login_url, data={"username": username, "password": password}, timeout=10
+    client = SessionClient(
+        login, login_url, timeout=10.0, http2=True, transport=transport
     )
+    if _load_cookies(client, cookie_file, login_url, session_cookie):
+        logger.info("Reusing the saved next-episode session")
+    else:
+        client.log_in()
     return client
+
+
+def is_logged_in(client: httpx.Client) -> bool:
+    """
+    Checks whether the session of the client was confirmed by its login or by a page the site
+    served to it.
+    """
+    return client in _logged_in_clients
+
+
+def is_session_valid(
+    client: httpx.Client,
+    login_url: str,
+    session_check_url: str | None = None,
+    session_cookie: str | None = None,
+) -> bool:
+    """
+    Checks whether the client has a session cookie which hasn't expired and, with a
+    session_check_url, whether that page is served without sending the client to the login.
+    """
+    if not _get_session_cookies(client, login_url, session_cookie):
+        _logged_in_clients.discard(client)
+        return False
+    if not session_check_url:
+        return True
+
+    try:
+        # the SessionClient would log in again instead of reporting the redirect
+        response = httpx.Client.send(
+            client, client.build_request("GET", session_check_url)
+        )
+    except httpx.HTTPError as e:
+        logger.warning("Failed to check the next-episode session: %s", e)
+        return False
+    if response.status_code in (401, 403):
+        valid = False
+    elif response.is_redirect:
+        valid = not _is_login_redirect(response)
+    else:
+        valid = response.is_success
+    if not valid:
+        _logged_in_clients.discard(client)
+    return valid
+
+
+def save_session_cookies(client: httpx.Client, cookie_file=None):
+    """
+    Saves the cookies of the client, readable by the owner only. The cookies of a client
+    whose session wasn't confirmed aren't saved, they'd be reused as a logged-out session.
+    """
+    if not is_logged_in(client):
+        logger.debug("The next-episode session isn't confirmed, not saving its cookies")
+        return
+    try:
+        cookie_file = cookie_file or get_data_directory().joinpath(COOKIE_JAR)
+        os.makedirs(os.path.dirname(cookie_file), exist_ok=True)
+        with open(
+            os.open(cookie_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb"
+        ) as file:
+            pickle.dump(list(client.cookies.jar), file)
+    except Exception as e:
+        logger.warning("Failed to save the next-episode session: %s", e)
+
+
+def _load_cookies(
+    client: httpx.Client, cookie_file, login_url: str, session_cookie: str | None = None
+) -> bool:
+    if not os.path.exists(cookie_file):
+        return False
+    try:
+        with open(cookie_file, "rb") as file:
+            cookies: list[Cookie] = pickle.load(file)
+    except Exception as e:
+        logger.warning("Failed to load the saved next-episode session: %s", e)
+        return False
+    for cookie in cookies:
+        client.cookies.jar.set_cookie(cookie)
+    return bool(_get_session_cookies(client, login_url, session_cookie))
+
+
+def _get_session_cookies(
+    client: httpx.Client, login_url: str, session_cookie: str | None = None
+) -> list[Cookie]:
+    host = (urlsplit(login_url).hostname or "").lower()
+    now = time.time()
+    return [
+        cookie
+        for cookie in client.cookies.jar
+        if _is_cookie_of_host(cookie, host) and _is_session_cookie(cookie, session_cookie) and not cookie.is_expired(now)
+    ]
+
+
+def _is_cookie_of_host(cookie: Cookie, host: str) -> bool:
+    # the cookies of the host itself or of a domain it's a subdomain of
+    domain = cookie.domain.lstrip(".").lower()
+    return bool(domain) and (host == domain or host.endswith(f".{domain}"))
+
+
+def _is_session_cookie(cookie: Cookie, session_cookie: str | None) -> bool:
+    return session_cookie is None or cookie.name == session_cookie
+
+
+def _is_login_successful(
+    response: httpx.Response,
+    client: httpx.Client,
+    login_url: str,
+    session_cookie: str | None = None,
+) -> bool:
+    # a successful login sets the session cookie and redirects away from the form, a page
+    # served by the login itself is only a login when it sets the named session cookie
+    if response.status_code >= 400 or not _get_session_cookies(
+        client, login_url, session_cookie
+    ):
+        return False
+    if response.is_redirect:
+        return not _is_login_redirect(response)
+    return session_cookie is not None and session_cookie in response.cookies
+
+
+def _is_login_redirect(response: httpx.Response) -> bool:
+    return response.is_redirect and "login" in response.headers.get("location", "").lower()
@@ -0,0 +1,130 @@
+"""
+This module contains the pipeline which overlaps the scrape, image and calendar stages of a run.
+
+The three stages run on the event loop of the image downloader and hand the months over
+through bounded queues: while the posters of month N download, month N+1 is fetched and
+parsed on a worker thread and the events of month N-1 are written on another one. Every
+stage still handles the months in order, so the series data and NO_LONGER_EXISTING_EVENTS
+are updated exactly as with the sequential loop.
+"""
+
+import asyncio
+from collections.abc import Callable, Iterator
+from logging import getLogger
+import time
+
+from common_dto.events import CalendarDtoPickled
+
+from . import tracing
+from .general_util import get_anime_urls_from_events_v2
+from .get_image_from_url import ImageDownloadService
+
+logger = getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 2
+
+# marks the end of the months on a queue
+_DONE = object()
+
+
+class MonthPipeline:
+    """
+    Runs the months of a run through the scrape, image and calendar stages concurrently.
+    """
+
+    def __init__(
+        self,
+        image_downloader: ImageDownloadService,
+        write_events: Callable[[list[CalendarDtoPickled]], None],
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        """
+        Args:
+            image_downloader (ImageDownloadService): Downloads the posters, the stages run on its loop.
+            write_events (Callable): Writes the events of a month to the calendar, called on a worker thread.
+            queue_size (int): The number of months waiting between two stages at most.
+        """
+        self.image_downloader = image_downloader
+        self.write_events = write_events
+        self.queue_size = max(1, queue_size)
+        self.months = 0
+        self.stage_seconds = {"scrape": 0.0, "image": 0.0, "calendar": 0.0}
+
+    def run(self, months: Iterator[list[CalendarDtoPickled]]):
+        """
+        Runs the months through the pipeline, blocking until the last month's events are written.
+
+        Args:
+            months (Iterator): The updated series of each month, e.g. from get_series_for_years.
+        """
+        self.image_downloader.run(self.run_async(months))
+
+    async def run_async(self, months: Iterator[list[CalendarDtoPickled]]):
+        image_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        calendar_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        start_time = time.time()
+        # the stages are started inside the span, so the spans of the months are its children
+        with tracing.span("pipeline") as span:
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    task_group.create_task(self._scrape(months, image_queue))
+                    task_group.create_task(
+                        self._download_images(image_queue, calendar_queue)
+                    )
+                    task_group.create_task(self._write_events(calendar_queue))
+            except ExceptionGroup as group:
+                # the run fails with the error of the first stage, as the sequential loop
+                # did, the stages which failed besides it are logged
+                for error in group.exceptions[1:]:
+                    logger.error("Pipeline stage failed too: %r", error, exc_info=error)
+                raise group.exceptions[0]
+            finally:
+                await asyncio.to_thread(_close, months)
+            span.count("months", self.months)
+        logger.info(
+            "Pipeline ran %d months in %.2f secs, busy secs per stage: %s",
+            self.months,
+            time.time() - start_time,
+            {stage: round(seconds, 2) for stage, seconds in self.stage_seconds.items()},
+        )
+
+    async def _scrape(self, months: Iterator, image_queue: asyncio.Queue):
+        while True:
+            start_time = time.time()
+            # the fetches, the parsing and the diffing run on a worker thread
+            data = await asyncio.to_thread(next, months, _DONE)
+            self.stage_seconds["scrape"] += time.time() - start_time
+            await image_queue.put(data)
+            if data is _DONE:
+                return
+
+    async def _download_images(
+        self, image_queue: asyncio.Queue, calendar_queue: asyncio.Queue
+    ):
+        while (data := await image_queue.get()) is not _DONE:
+            start_time = time.time()
+            await self.image_downloader.download_async(
+                get_anime_urls_from_events_v2(data)
+            )
+            self.stage_seconds["image"] += time.time() - start_time
+            await calendar_queue.put(data)
+        await calendar_queue.put(_DONE)
+
+    async def _write_events(self, calendar_queue: asyncio.Queue):
+        while (data := await calendar_queue.get()) is not _DONE:
+            start_time = time.time()
+            with tracing.span("write_events", events=len(data)):
+                await asyncio.to_thread(self.write_events, data)
+            self.stage_seconds["calendar"] += time.time() - start_time
+            self.months += 1
+
+
+def _close(months: Iterator):
+    close = getattr(months, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except ValueError:
+        # a failed run may leave the generator running on the scrape thread
+        logger.debug("The months generator is still running, not closing it")
@@ -1,22 +1,87 @@
-import pickle
+from collections.abc import Iterator
+import contextlib
+import logging
+import os
 import pathlib
+import shutil
+import tempfile
 
 from .time_utility import get_current_year, get_current_month
 
-DATA_DIRECTORY = pathlib.Path(__file__).parent.parent.joinpath("data")
-# DATA_FILE = DATA_DIRECTORY.joinpath("data.pickle")
+logger = logging.getLogger(__name__)
 
-# series_list_data = DATA_DIRECTORY.joinpath("series_list_data.pickle")
+# the state of the real runs, the fixture archives of the http modes are kept here too
+DATA_DIRECTORY = pathlib.Path(__file__).parent.parent.joinpath("data")  # utility  # src
+IMAGE_DIRECTORY = DATA_DIRECTORY.parent.joinpath("images")
 
-series_to_image_mapping = DATA_DIRECTORY.joinpath("series_to_image_mapping.pickle")
+# the pickles the state store migrates from, in the data directory of the run
+SERIES_TO_IMAGE_MAPPING_PICKLE = "series_to_image_mapping.pickle"
+SERIES_DATA_PICKLE = "series_data.pickle"
+DAY_FINGERPRINTS_PICKLE = "day_fingerprints.pickle"
 
-new_series_dic_data = DATA_DIRECTORY.joinpath("series_data.pickle")
+# the directories of the run, switched to a scratch copy by scratch_state_directories
+_data_directory = DATA_DIRECTORY
+_image_directory = IMAGE_DIRECTORY
 
-if not new_series_dic_data.exists():
-    new_series_dic_data.touch()
 
-if not series_to_image_mapping.exists():
-    series_to_image_mapping.touch()
+def get_data_directory() -> pathlib.Path:
+    """
+    Returns the data/ directory the run works on.
+    """
+    return _data_directory
+
+
+def get_image_directory() -> pathlib.Path:
+    """
+    Returns the images/ directory the run works on.
+    """
+    return _image_directory
+
+
+@contextlib.contextmanager
+def scratch_state_directories(name: str) -> Iterator[pathlib.Path]:
+    """
+    Points the run at a copy of data/ and images/ in a temporary directory, which is removed
+    when the block is done. The state of the real runs is neither changed by the run nor
+    changes under it: the sqlite store, the caches, the session cookies and the images.
+
+    The state is opened lazily, the block has to be entered before the first state is created.
+
+    Args:
+        name (str): Names the temporary directory, e.g. the http mode.
+
+    Yields:
+        pathlib.Path: The temporary directory.
+    """
+    global _data_directory, _image_directory
+    scratch = pathlib.Path(tempfile.mkdtemp(prefix=f"series-{name}-"))
+    try:
+        data_directory = scratch.joinpath("data")
+        image_directory = scratch.joinpath("images")
+        if DATA_DIRECTORY.exists():
+            shutil.copytree(
+                DATA_DIRECTORY,
+                data_directory,
+                ignore=shutil.ignore_patterns("http_fixtures*"),
+            )
+        if IMAGE_DIRECTORY.exists():
+            # the images are replaced, never written in place, a link is as good as a copy
+            shutil.copytree(IMAGE_DIRECTORY, image_directory, copy_function=_link_or_copy)
+        data_directory.mkdir(exist_ok=True)
+        image_directory.mkdir(exist_ok=True)
+        logger.info("The %s run works on a copy of data/ and images/ in %s", name, scratch)
+        _data_directory, _image_directory = data_directory, image_directory
+        yield scratch
+    finally:
+        _data_directory, _image_directory = DATA_DIRECTORY, IMAGE_DIRECTORY
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
 
 
 def clean_old_data(data: dict):
@@ -38,39 +103,3 @@ def clean_old_data(data: dict):
                 del data[key]
 
     return
-
-
-def get_picked_series_data():
-    """
-    Retrieves the series data from the pickle file.
-
-    Returns
-    -------
-    dict
-        The series data
-    """
-    with open(new_series_dic_data, "rb") as file:
-        try:
-            data = pickle.load(file)
-        except Exception as e:
-            print(e)
-            data = {}
-    return data
-
-
-def save_picked_series_data(data: dict):
-    """
-    Saves the given series data to a pickle file.
-
-    Parameters
-    ----------
-    data : dict
-        The series data to be saved
-
-    Returns
-    -------
-    None
-    """
-    with open(new_series_dic_data, "wb") as file:
-        clean_old_data(data)
-        pickle.dump(data, file)  # pylint: disable=consider-using-with
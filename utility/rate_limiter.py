@@ -0,0 +1,97 @@
+"""
+This module contains an adaptive token bucket rate limiter for the Google Calendar API.
+
+The bucket refills at a rate which is halved every time the API answers with a rate limit
+error and grows back slowly with every successful call, so the writers settle just below the
+quota of the account instead of hitting it over and over.
+"""
+
+import random
+import threading
+import time
+
+# the default Google Calendar quota is 600 requests per minute per user
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+
+
+class AdaptiveTokenBucket:
+    """
+    A thread-safe token bucket whose refill rate adapts to rate limit errors.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        capacity: int | None = None,
+        min_requests_per_second: float = 0.5,
+    ):
+        self.max_rate = requests_per_second
+        self.min_rate = min(min_requests_per_second, requests_per_second)
+        self.rate = requests_per_second
+        self.capacity = capacity or max(1, int(requests_per_second))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """
+        Grows the rate back towards the configured one after a successful call.
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_rate_limited(self):
+        """
+        Halves the rate and empties the bucket after a rate limit error.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 32.0) -> float:
+    """
+    Returns the exponential backoff delay of a retry with full jitter.
+
+    Args:
+        attempt (int): The number of the retry, starting at 0.
+        base (float): The delay of the first retry in seconds.
+        cap (float): The maximum delay in seconds.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def is_rate_limit_error(exception: Exception) -> bool:
+    """
+    Checks whether an exception of the calendar client is a 429 or a 403 rateLimitExceeded.
+    """
+    # googleapiclient.errors.HttpError keeps the status on resp, httpx errors on response
+    response = getattr(exception, "resp", None) or getattr(exception, "response", None)
+    status = getattr(response, "status", None) or getattr(
+        response, "status_code", None
+    )
+    if status is not None:
+        status = int(status)
+    if status == 429:
+        return True
+    return status == 403 and "ratelimitexceeded" in str(exception).lower()
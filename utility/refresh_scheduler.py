@@ -0,0 +1,162 @@
+"""
+This module contains the scheduler which decides which months of the calendar are fetched in a run.
+
+The current and the next month are fetched on every run. The months further out are fetched
+less and less often, every min_interval doubling with every month ahead up to max_interval,
+and a month is fetched more often the more often its contents changed when it was fetched.
+Months without a history, and every month on a full sweep, are always fetched.
+"""
+
+from dataclasses import astuple, dataclass
+import logging
+import threading
+import time
+
+from .state_store import SeriesStateStore
+from .time_utility import get_current_month, get_current_year
+
+logger = logging.getLogger(__name__)
+
+# the current month and the next one are fetched on every run
+NEAR_TERM_MONTHS = 1
+MIN_REFRESH_INTERVAL = 6 * 60 * 60
+MAX_REFRESH_INTERVAL = 7 * 24 * 60 * 60
+# runs scheduled at the same time every day are a little less than a day apart
+SCHEDULE_SLACK = 0.1
+
+
+@dataclass
+class MonthHistory:
+    last_checked: float
+    last_changed: float | None
+    checks: int
+    changes: int
+
+    @property
+    def change_rate(self) -> float:
+        return self.changes / self.checks if self.checks else 1.0
+
+
+class MonthRefreshScheduler:
+    """
+    Decides which months are fetched and records when the months were checked and changed.
+    """
+
+    def __init__(
+        self,
+        full_sweep: bool = False,
+        min_interval: float = MIN_REFRESH_INTERVAL,
+        max_interval: float = MAX_REFRESH_INTERVAL,
+        near_term_months: int = NEAR_TERM_MONTHS,
+    ):
+        """
+        Args:
+            full_sweep (bool): Fetches every month regardless of its history.
+            min_interval (float): The seconds between two fetches of the first month after the near term.
+            max_interval (float): The seconds between two fetches of a month at most.
+            near_term_months (int): The months after the current one which are fetched on every run.
+        """
+        self.full_sweep = full_sweep
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.near_term_months = near_term_months
+        self._store = SeriesStateStore()
+        self._history = {
+            key: MonthHistory(*values)
+            for key, values in self._store.load_month_refresh_history().items()
+        }
+        self._recorded: set[str] = set()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Resets the counters, the next ones belong to a new run.
+        """
+        self.due = 0
+        self.skipped = 0
+
+    def is_due(self, month: int, year: int, known: bool = True) -> bool:
+        """
+        Checks whether the month has to be fetched in this run.
+
+        Args:
+            month (int): The month.
+            year (int): The year of the month.
+            known (bool): Whether the series data has the month, unknown months are always due.
+        """
+        history = self._history.get(f"{month}_{year}")
+        due = self.full_sweep or not known or history is None
+        if not due:
+            interval = self.refresh_interval(_months_ahead(month, year), history)
+            due = time.time() - history.last_checked >= interval * (1 - SCHEDULE_SLACK)
+        with self._lock:
+            if due:
+                self.due += 1
+            else:
+                self.skipped += 1
+        return due
+
+    def refresh_interval(self, months_ahead: int, history: MonthHistory) -> float:
+        """
+        Returns the seconds between two fetches of a month.
+
+        Args:
+            months_ahead (int): The months between the current month and the month.
+            history (MonthHistory): The refresh history of the month.
+        """
+        if months_ahead <= self.near_term_months:
+            return 0.0
+        interval = min(
+            self.max_interval,
+            self.min_interval * 2 ** (months_ahead - self.near_term_months - 1),
+        )
+        # a month which changed on every fetch is fetched every min_interval
+        interval *= 1 - history.change_rate
+        return max(self.min_interval, interval)
+
+    def record(self, month: int, year: int, changed: bool):
+        """
+        Records that the month was fetched in this run and whether its contents changed.
+        """
+        key = f"{month}_{year}"
+        now = time.time()
+        with self._lock:
+            history = self._history.get(key) or MonthHistory(now, None, 0, 0)
+            history.last_checked = now
+            history.checks += 1
+            if changed:
+                history.last_changed = now
+                history.changes += 1
+            self._history[key] = history
+            self._recorded.add(key)
+
+    def save(self):
+        """
+        Saves the history of the months fetched in this run, without the previous months.
+        """
+        current = (get_current_year(), get_current_month())
+        with self._lock:
+            past_keys = {key for key in self._history if _year_month(key) < current}
+            for key in past_keys:
+                del self._history[key]
+            self._store.save_month_refresh_history(
+                {
+                    key: astuple(self._history[key])
+                    for key in self._recorded - past_keys
+                },
+                past_keys,
+            )
+            self._recorded.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"due": self.due, "skipped": self.skipped}
+
+
+def _months_ahead(month: int, year: int) -> int:
+    return (year - get_current_year()) * 12 + month - get_current_month()
+
+
+def _year_month(key: str) -> tuple[int, int]:
+    month, year = [int(i) for i in key.split("_")]
+    return year, month
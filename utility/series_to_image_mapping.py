@@ -1,15 +1,9 @@
-import io
-import os
-import pickle
-import pathlib
+from collections.abc import Iterable
 import logging
 
 from decorator_utils import singleton_with_no_parameters
 
-from .general_util import clean_not_existing_series_data_from_image_mapping_v2
-from .pickle_utility import (
-    get_picked_series_data,
-)
+from .state_store import SeriesStateStore
 
 logger = logging.getLogger(__name__)
 
@@ -17,83 +11,99 @@ logger = logging.getLogger(__name__)
 @singleton_with_no_parameters
 class SeriesToImageMapping:
     """
-    Fully encapsulates the series-to-image mapping pickle.
-    Handles internal file path, cache, load, save, and cleaning.
+    Fully encapsulates the series-to-image mapping of the state store.
+    Handles the cache, load, save, and cleaning.
     """
 
     def __init__(self):
-        print("Initializing SeriesToImageMapping...")
-        self._data_dir = pathlib.Path(__file__).parent.parent / "data"
-        self._data_dir.mkdir(exist_ok=True)  # create if missing
-        self._file = self._data_dir / "series_to_image_mapping.pickle"
-        if not self._file.exists():
-            self._file.touch()
+        logger.debug("Initializing SeriesToImageMapping...")
+        self._store = SeriesStateStore()
 
         self._data: dict[str, str] | None = None  # lazy load
+        # an empty mapping after a failed load doesn't mean that no image is referenced
+        self.load_failed = False
+        self._saved_data: dict[str, str] = {}  # the mapping as it is in the store
+
+    def reload(self):
+        """
+        Drops the mapping in memory, the next get_mapping loads it from the state store again.
+        A failed run may have left entries which were never saved.
+        """
+        self._data = None
+        self.load_failed = False
+        self._saved_data = {}
 
     def get_mapping(self) -> dict | None:
         """
         Retrieve the series-to-image mapping (cached in memory).
-        Automatically cleans entries that no longer exist in series data.
+        Stale entries are only cleaned when the mapping is saved.
         """
         if self._data is not None:
             return self._data
 
         try:
-            with io.open(self._file, "rb") as f:
-                self._data = pickle.load(f)
-                # Clean any stale entries
-                keys_to_be_deleted = (
-                    clean_not_existing_series_data_from_image_mapping_v2(
-                        self._data, get_picked_series_data()
-                    )
-                )
-                self.__delete_removed_image_mapping(keys_to_be_deleted)
+            self._data = self._store.load_image_mapping()
+            self._saved_data = dict(self._data)
         except Exception as e:
             logger.error("Failed to load series-to-image mapping: %s" % e)
             self._data = {}
+            self.load_failed = True
 
         logger.debug(
             "loaded mapping with %s entries", len(self._data if self._data else {})
         )
         return self._data
 
-    def save_mapping(self):
+    def save_mapping(self, stale_urls: Iterable[str] = ()):
         """
-        Save the series-to-image mapping to disk.
-        Persists whatever is currently in self._data.
+        Save the series-to-image mapping to the state store.
+        Only the entries which changed since the load are written.
+
+        Parameters
+        ----------
+        stale_urls : Iterable[str]
+            The series urls which aren't in the series data anymore, as returned by
+            SeriesStateStore.save, or whose images were evicted. Their entries are
+            removed before saving.
         """
+        if self._data is None:
+            logger.warning("No data to save, skipping.")
+            return
+
+        stale_urls = set(stale_urls)
+        # entries which went stale before the cleanup moved here are swept once
+        if self._store.pop_flag("image_mapping_swept"):
+            stale_urls |= self._store.get_unreferenced_image_urls()
+        if stale_urls:
+            logger.info("Removing %d stale image mappings", len(stale_urls))
+            self.__delete_removed_image_mapping(list(stale_urls))
 
         logger.debug(
             "Saving series-to-image mapping with %d entries",
             len(self._data) if self._data else 0,
         )
-        if self._data is None or len(self._data) == 0:
-            logger.warning("No data to save, skipping.")
-            return
 
+        upserted = {
+            url: str(path)
+            for url, path in self._data.items()
+            if self._saved_data.get(url) != str(path)
+        }
+        deleted = self._saved_data.keys() - self._data.keys()
         try:
-            with io.open(self._file, "wb") as f:
-                pickle.dump(self._data, f)
+            self._store.save_image_mapping(upserted, deleted)
+            self._saved_data = {url: str(path) for url, path in self._data.items()}
         except Exception as e:
             logger.error("Failed to save series-to-image mapping: %s" % e)
 
     def __delete_removed_image_mapping(self, keys_to_be_deleted: list[str]):
-        """Delete removed image mappings from the internal data."""
+        """
+        Delete removed image mappings from the internal data.
+        Their files are removed by the ImageCacheManager at the end of the run.
+        """
         if self._data is None:
             return
 
         for key in keys_to_be_deleted:
             if key in self._data:
-                image_path = self._data[key]
-                logger.debug("deleting", key, "->", image_path)
-
-                # Only delete if image_path is a valid str or Path
-                if isinstance(image_path, (str, bytes, os.PathLike)):
-                    try:
-                        if os.path.exists(image_path):
-                            os.remove(image_path)
-                    except Exception as e:
-                        logger.debug(f"Failed to delete {image_path}: {e}")
-
-                del self._data[key]
+                image_path = self._data.pop(key)
+                logger.debug("deleting %s -> %s", key, image_path)
@@ -0,0 +1,490 @@
+"""
+This module contains the SQLite state store which replaces the series_data.pickle blob.
+
+The events of every month, the day cell fingerprints, the refresh history of every month,
+the series-to-image mapping, the poster url of every show and of every content-addressed
+image are kept in indexed tables of data/series_state.sqlite3. The months are loaded lazily
+the first time they're accessed and only the months which were set or deleted during the run
+are written back, each month replaced in the same transaction. The existing pickles are
+migrated into the store once, the first time it's opened.
+"""
+
+from collections.abc import Iterator, MutableMapping
+import datetime
+import logging
+import pickle
+import sqlite3
+import threading
+
+from common_dto.events import CalendarDtoPickled
+from decorator_utils import singleton_with_no_parameters
+
+from .pickle_utility import (
+    DAY_FINGERPRINTS_PICKLE,
+    IMAGE_DIRECTORY,
+    SERIES_DATA_PICKLE,
+    SERIES_TO_IMAGE_MAPPING_PICKLE,
+    get_data_directory,
+    get_image_directory,
+)
+
+logger = logging.getLogger(__name__)
+
+STATE_DATABASE = "series_state.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+    month_key TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS events (
+    month_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    calendar_id TEXT,
+    PRIMARY KEY (month_key, position)
+);
+CREATE INDEX IF NOT EXISTS events_month_key ON events (month_key);
+CREATE INDEX IF NOT EXISTS events_url ON events (url);
+CREATE TABLE IF NOT EXISTS day_fingerprints (
+    month_key TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (month_key, day)
+);
+CREATE TABLE IF NOT EXISTS image_mappings (
+    url TEXT PRIMARY KEY,
+    image_path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS image_sources (
+    src_url TEXT PRIMARY KEY,
+    image_path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS poster_urls (
+    show_url TEXT PRIMARY KEY,
+    src_url TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS month_refresh (
+    month_key TEXT PRIMARY KEY,
+    last_checked REAL NOT NULL,
+    last_changed REAL,
+    checks INTEGER NOT NULL,
+    changes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class LazyMonthMapping(MutableMapping):
+    """
+    A dict of month_key -> value which loads a month from the store on first access
+    and remembers which months were set or deleted since the last save.
+    """
+
+    def __init__(self, keys: set[str], load_month):
+        self._keys = set(keys)
+        self._load_month = load_month
+        self._loaded: dict = {}
+        self.dirty: set[str] = set()
+        self.deleted: set[str] = set()
+
+    def __getitem__(self, key: str):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._loaded:
+            self._loaded[key] = self._load_month(key)
+        return self._loaded[key]
+
+    def __setitem__(self, key: str, value):
+        self._keys.add(key)
+        self._loaded[key] = value
+        self.dirty.add(key)
+        self.deleted.discard(key)
+
+    def __delitem__(self, key: str):
+        if key not in self._keys:
+            raise KeyError(key)
+        self._keys.remove(key)
+        self._loaded.pop(key, None)
+        self.dirty.discard(key)
+        self.deleted.add(key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(sorted(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def mark_saved(self):
+        self.dirty.clear()
+        self.deleted.clear()
+
+
+@singleton_with_no_parameters
+class SeriesStateStore:
+    """
+    The SQLite store of the series data, the day fingerprints and the image mapping.
+    """
+
+    def __init__(self):
+        self._data_directory = get_data_directory()
+        self._data_directory.mkdir(exist_ok=True)
+        # the scraper may run on a worker thread, every access goes through the lock
+        self._connection = sqlite3.connect(
+            self._data_directory.joinpath(STATE_DATABASE), check_same_thread=False
+        )
+        self._lock = threading.RLock()
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+        self._migrate_pickles()
+        if get_image_directory() != IMAGE_DIRECTORY:
+            self._rebase_image_paths(IMAGE_DIRECTORY, get_image_directory())
+
+    def rollback(self):
+        """
+        Rolls back a transaction a failed run left open, the next run starts from the saved state.
+        """
+        with self._lock:
+            self._connection.rollback()
+
+    def load_series_data(self) -> LazyMonthMapping:
+        """
+        Returns the series data as a lazy {month_key: list[CalendarDtoPickled]} mapping.
+        """
+        with self._lock:
+            keys = {row[0] for row in self._connection.execute("SELECT month_key FROM months")}
+        return LazyMonthMapping(keys, self._load_month_events)
+
+    def load_day_fingerprints(self) -> LazyMonthMapping:
+        """
+        Returns the day fingerprints as a lazy {month_key: {day: fingerprint}} mapping.
+        """
+        with self._lock:
+            keys = {
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT DISTINCT month_key FROM day_fingerprints"
+                )
+            }
+        return LazyMonthMapping(keys, self._load_month_fingerprints)
+
+    def load_image_mapping(self) -> dict[str, str]:
+        """
+        Returns the series url -> image path mapping.
+        """
+        with self._lock:
+            return dict(
+                self._connection.execute("SELECT url, image_path FROM image_mappings")
+            )
+
+    def save(
+        self,
+        series_data: LazyMonthMapping,
+        day_fingerprints: LazyMonthMapping | None = None,
+    ) -> set[str]:
+        """
+        Writes the months which were set or deleted since the last save in one transaction.
+        The fingerprints of a deleted month are deleted with it.
+
+        Returns the series urls which were removed from the written months and aren't in
+        any other month either, found through the url index without reading the other months.
+        """
+        removed_urls: set[str] = set()
+        with self._lock, self._connection:
+            for key in series_data.deleted:
+                removed_urls |= self._get_month_urls(key)
+                self._delete_month(key)
+            for key in series_data.dirty:
+                events = series_data[key]
+                removed_urls |= self._get_month_urls(key) - {
+                    event.url for event in events
+                }
+                self._replace_month_events(key, events)
+            stale_urls = {
+                url for url in removed_urls if not self._is_url_referenced(url)
+            }
+
+            if day_fingerprints is not None:
+                for key in day_fingerprints.deleted:
+                    self._connection.execute(
+                        "DELETE FROM day_fingerprints WHERE month_key = ?", (key,)
+                    )
+                for key in day_fingerprints.dirty:
+                    if key in series_data:
+                        self._replace_month_fingerprints(key, day_fingerprints[key])
+        logger.debug(
+            "Saved %d months and deleted %d months",
+            len(series_data.dirty),
+            len(series_data.deleted),
+        )
+        series_data.mark_saved()
+        if day_fingerprints is not None:
+            day_fingerprints.mark_saved()
+        return stale_urls
+
+    def get_unreferenced_image_urls(self) -> set[str]:
+        """
+        Returns the urls of the image mapping which aren't in any month, in a single query.
+        """
+        with self._lock:
+            return {
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT url FROM image_mappings WHERE url NOT IN (SELECT url FROM events)"
+                )
+            }
+
+    def get_last_air_dates(self) -> dict[str, str]:
+        """
+        Returns the latest air date (an ISO date) of every series url of the series data.
+        """
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT url, MAX(start_date) FROM events GROUP BY url"
+                )
+            )
+
+    def pop_flag(self, key: str) -> bool:
+        """
+        Returns True the first time it's called for a key, False afterwards.
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO metadata (key, value) VALUES (?, ?)",
+                (key, datetime.datetime.now().isoformat()),
+            )
+            return cursor.rowcount == 1
+
+    def save_image_mapping(self, upserted: dict[str, str], deleted: set[str]):
+        """
+        Upserts and deletes entries of the image mapping in one transaction.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO image_mappings (url, image_path) VALUES (?, ?)",
+                upserted.items(),
+            )
+            self._connection.executemany(
+                "DELETE FROM image_mappings WHERE url = ?", ((url,) for url in deleted)
+            )
+
+    def load_month_refresh_history(self) -> dict[str, tuple[float, float | None, int, int]]:
+        """
+        Returns the (last_checked, last_changed, checks, changes) of every month key.
+        """
+        with self._lock:
+            return {
+                row[0]: tuple(row[1:])
+                for row in self._connection.execute(
+                    "SELECT month_key, last_checked, last_changed, checks, changes FROM month_refresh"
+                )
+            }
+
+    def save_month_refresh_history(
+        self,
+        history: dict[str, tuple[float, float | None, int, int]],
+        deleted: set[str] = frozenset(),
+    ):
+        """
+        Upserts and deletes the refresh history of months in one transaction.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO month_refresh (month_key, last_checked, last_changed, checks, changes) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((key, *values) for key, values in history.items()),
+            )
+            self._connection.executemany(
+                "DELETE FROM month_refresh WHERE month_key = ?",
+                ((key,) for key in deleted),
+            )
+
+    def get_image_source(self, src_url: str) -> str | None:
+        """
+        Returns the path of the content-addressed image downloaded from the poster url.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT image_path FROM image_sources WHERE src_url = ?", (src_url,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_image_source(self, src_url: str, image_path: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO image_sources (src_url, image_path) VALUES (?, ?)",
+                (src_url, image_path),
+            )
+
+    def get_poster_url(self, show_url: str) -> tuple[str, float] | None:
+        """
+        Returns the cached poster url of the show page and the time it was fetched at.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT src_url, fetched_at FROM poster_urls WHERE show_url = ?",
+                (show_url,),
+            ).fetchone()
+
+    def save_poster_url(self, show_url: str, src_url: str, fetched_at: float):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO poster_urls (show_url, src_url, fetched_at) VALUES (?, ?, ?)",
+                (show_url, src_url, fetched_at),
+            )
+
+    def _load_month_events(self, key: str) -> list[CalendarDtoPickled]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT summary, url, start_time, start_date, calendar_id FROM events "
+                "WHERE month_key = ? ORDER BY position",
+                (key,),
+            ).fetchall()
+        events = []
+        for summary, url, start_time, start_date, calendar_id in rows:
+            event = CalendarDtoPickled(
+                summary=summary,
+                url=url,
+                start_time=start_time,
+                start_date=datetime.date.fromisoformat(start_date),
+            )
+            event.calendar_id = calendar_id
+            events.append(event)
+        return events
+
+    def _load_month_fingerprints(self, key: str) -> dict[int, str]:
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT day, fingerprint FROM day_fingerprints WHERE month_key = ?",
+                    (key,),
+                )
+            )
+
+    def _get_month_urls(self, key: str) -> set[str]:
+        return {
+            row[0]
+            for row in self._connection.execute(
+                "SELECT DISTINCT url FROM events WHERE month_key = ?", (key,)
+            )
+        }
+
+    def _is_url_referenced(self, url: str) -> bool:
+        return (
+            self._connection.execute(
+                "SELECT 1 FROM events WHERE url = ? LIMIT 1", (url,)
+            ).fetchone()
+            is not None
+        )
+
+    def _delete_month(self, key: str):
+        for table in ("events", "day_fingerprints", "months"):
+            self._connection.execute(
+                f"DELETE FROM {table} WHERE month_key = ?", (key,)
+            )
+
+    def _replace_month_events(self, key: str, events: list[CalendarDtoPickled]):
+        self._connection.execute(
+            "INSERT OR IGNORE INTO months (month_key) VALUES (?)", (key,)
+        )
+        self._connection.execute("DELETE FROM events WHERE month_key = ?", (key,))
+        self._connection.executemany(
+            "INSERT INTO events (month_key, position, url, start_date, start_time, summary, calendar_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    key,
+                    position,
+                    event.url,
+                    event.start_date.isoformat(),
+                    event.start_time,
+                    event.summary,
+                    event.calendar_id,
+                )
+                for position, event in enumerate(events)
+            ),
+        )
+
+    def _replace_month_fingerprints(self, key: str, fingerprints: dict[int, str]):
+        self._connection.execute(
+            "DELETE FROM day_fingerprints WHERE month_key = ?", (key,)
+        )
+        self._connection.executemany(
+            "INSERT INTO day_fingerprints (month_key, day, fingerprint) VALUES (?, ?, ?)",
+            ((key, day, fingerprint) for day, fingerprint in fingerprints.items()),
+        )
+
+    def _rebase_image_paths(self, old_directory, new_directory):
+        """
+        Points the image paths at the copy of images/ the run works on, see scratch_state_directories.
+        """
+        old_prefix = str(old_directory)
+        with self._lock, self._connection:
+            for table in ("image_mappings", "image_sources"):
+                self._connection.execute(
+                    f"UPDATE {table} SET image_path = ? || substr(image_path, ?) "
+                    "WHERE substr(image_path, 1, ?) = ?",
+                    (str(new_directory), len(old_prefix) + 1, len(old_prefix), old_prefix),
+                )
+
+    def _migrate_pickles(self):
+        """
+        Imports series_data.pickle, day_fingerprints.pickle and series_to_image_mapping.pickle
+        the first time the store is opened. The pickles are left on disk.
+        """
+        with self._lock:
+            migrated = self._connection.execute(
+                "SELECT value FROM metadata WHERE key = 'pickles_migrated'"
+            ).fetchone()
+        if migrated is not None:
+            return
+
+        series_data = _load_pickle(self._data_directory.joinpath(SERIES_DATA_PICKLE))
+        day_fingerprints = _load_pickle(
+            self._data_directory.joinpath(DAY_FINGERPRINTS_PICKLE)
+        )
+        image_mapping = _load_pickle(
+            self._data_directory.joinpath(SERIES_TO_IMAGE_MAPPING_PICKLE)
+        )
+
+        with self._lock, self._connection:
+            for key, events in series_data.items():
+                self._replace_month_events(key, events)
+            for key, fingerprints in day_fingerprints.items():
+                if key in series_data:
+                    self._replace_month_fingerprints(key, fingerprints)
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO image_mappings (url, image_path) VALUES (?, ?)",
+                ((url, str(path)) for url, path in image_mapping.items()),
+            )
+            self._connection.execute(
+                "INSERT INTO metadata (key, value) VALUES ('pickles_migrated', ?)",
+                (datetime.datetime.now().isoformat(),),
+            )
+        logger.info(
+            "Migrated %d months and %d image mappings from the pickles",
+            len(series_data),
+            len(image_mapping),
+        )
+
+
+def _load_pickle(path) -> dict:
+    # older runs created the pickles empty
+    if not path.exists() or path.stat().st_size == 0:
+        return {}
+    with open(path, "rb") as file:
+        try:
+            return pickle.load(file) or {}
+        except Exception as e:
+            logger.warning("Failed to load %s for the migration: %s", path.name, e)
+            return {}
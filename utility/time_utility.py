@@ -3,7 +3,16 @@ This module contains utility functions for time related tasks.
 """
 
 import calendar
-from datetime import date, datetime
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+CALENDAR_TIME_ZONE = "Asia/Kolkata"
+TIME_FORMAT = "%I:%M%p"
+
+# the events are shifted by an hour and last an hour
+EVENT_OFFSET = timedelta(hours=1)
+EVENT_DURATION = timedelta(hours=1)
 
 day_name_list = [
     "Sunday",
@@ -114,10 +123,81 @@ def merge_time_str_datetime_date(time_str: str, day: date) -> datetime:
     str
         A formatted datetime string in the format "YYYY-MM-DD HH:MMam/pm".
     """
-    date_time_series = datetime.strptime(time_str, "%I:%M%p")
-    combined_datetime = datetime.combine(day, date_time_series.time())
+    combined_datetime = datetime.combine(day, parse_time_str(time_str))
     return combined_datetime
 
 
+@lru_cache(maxsize=None)
+def parse_time_str(time_str: str) -> time:
+    """
+    Parses a time string like "7:30pm", memoized as there are only about 96 distinct values.
+
+    Parameters
+    ----------
+    time_str : str
+        The time string in the format "H:MMam/pm" (e.g., "7:30pm").
+
+    Returns
+    -------
+    time
+        The parsed time
+    """
+    return datetime.strptime(time_str, TIME_FORMAT).time()
+
+
+@lru_cache(maxsize=None)
+def _get_time_zone(time_zone: str) -> ZoneInfo:
+    return ZoneInfo(time_zone)
+
+
+@lru_cache(maxsize=8192)
+def get_event_start_end(
+    time_str: str, day: date, time_zone: str = CALENDAR_TIME_ZONE
+) -> tuple[datetime, datetime]:
+    """
+    Returns the time-zone-aware start and end of an event, computed once per (time, day).
+
+    Parameters
+    ----------
+    time_str : str
+        The time string in the format "H:MMam/pm" (e.g., "7:30pm").
+    day : datetime.date
+        The date of the event.
+    time_zone : str
+        The time zone of the event.
+
+    Returns
+    -------
+    tuple
+        The start and the end of the event
+    """
+    start_time = datetime.combine(day, parse_time_str(time_str), _get_time_zone(time_zone)) + EVENT_OFFSET
+    return start_time, start_time + EVENT_DURATION
+
+
+def get_events_start_end(
+    events: list, time_zone: str = CALENDAR_TIME_ZONE
+) -> list[tuple[datetime, datetime]]:
+    """
+    Converts a whole list of events (e.g. a month) into their time-zone-aware start and end.
+
+    Parameters
+    ----------
+    events : list
+        Events with a start_time string and a start_date.
+    time_zone : str
+        The time zone of the events.
+
+    Returns
+    -------
+    list
+        The (start, end) of every event, in the order of the events
+    """
+    return [
+        get_event_start_end(event.start_time, event.start_date, time_zone)
+        for event in events
+    ]
+
+
 if __name__ == "__main__":
     print(match_current_day("Sunday"))
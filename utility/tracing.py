@@ -0,0 +1,307 @@
+"""
+This module contains the tracing spans of a run and their export.
+
+A span times a stage of the run (the login, a month fetch, the parse of its page, a calendar
+write, ...) and carries counters like the bytes fetched or the events written. The spans nest
+through a context variable: the spans opened inside a span are its children, on the same thread,
+in the asyncio tasks it starts and on the worker threads it submits work to, as long as the
+context is copied to them (asyncio.to_thread does, the thread pools of the run copy it).
+
+When a run ends the spans are written as a Chrome trace event file, which chrome://tracing and
+Perfetto open, and summed up per span name into a Prometheus textfile, for the textfile
+collector of the node_exporter.
+"""
+
+from collections.abc import Iterator
+import contextlib
+from contextvars import ContextVar
+import itertools
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# the spans kept for the trace file of a run, the metrics count every span
+DEFAULT_MAX_SPANS = 100_000
+METRIC_PREFIX = "series"
+
+
+class Span:
+    """
+    A timed stage of the run with its attributes (labels like the month) and counters.
+    """
+
+    __slots__ = (
+        "id",
+        "parent_id",
+        "name",
+        "attributes",
+        "counters",
+        "thread_id",
+        "start",
+        "duration",
+    )
+
+    def __init__(self, span_id: int, parent_id: int | None, name: str, attributes: dict):
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.counters: dict[str, float] = {}
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+
+    def count(self, name: str, value: float = 1):
+        """
+        Adds the value to a counter of the span, e.g. span.count("bytes", len(content)).
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Collects the spans of a run and exports them when the run ends.
+    """
+
+    def __init__(self, max_spans: int = DEFAULT_MAX_SPANS):
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the spans and the totals, the next spans belong to a new run.
+        """
+        with self._lock:
+            self.spans: list[Span] = []
+            self.dropped = 0
+            self._totals: dict[str, dict] = {}
+            # the seconds of the outermost spans, the run without the waits between runs
+            self.run_seconds = 0.0
+            self.started_at = time.time()
+            self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Times the block as a span, the child of the current span.
+
+        Args:
+            name (str): The stage, the spans are summed up per name in the metrics.
+            **attributes: The labels of the span, e.g. month=1, year=2025.
+
+        Yields:
+            Span: The span, to add counters to.
+        """
+        parent = _current_span.get()
+        span = Span(
+            next(self._ids), parent.id if parent is not None else None, name, attributes
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            totals = self._totals.setdefault(
+                span.name,
+                {"spans": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "counters": {}},
+            )
+            totals["spans"] += 1
+            if span.parent_id is None:
+                self.run_seconds += span.duration
+            totals["seconds"] += span.duration
+            totals["max_seconds"] = max(totals["max_seconds"], span.duration)
+            if "error" in span.attributes:
+                totals["errors"] += 1
+            for counter, value in span.counters.items():
+                totals["counters"][counter] = totals["counters"].get(counter, 0) + value
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Returns the spans, errors, seconds, slowest span and counters per span name.
+        """
+        with self._lock:
+            return {
+                name: {**totals, "counters": dict(totals["counters"])}
+                for name, totals in self._totals.items()
+            }
+
+    def write_trace(self, path):
+        """
+        Writes the spans as a Chrome trace event file.
+        """
+        with self._lock:
+            spans = list(self.spans)
+            dropped = self.dropped
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": "series",
+                "ph": "X",
+                "ts": round((span.start - self._origin) * 1_000_000),
+                "dur": round(span.duration * 1_000_000),
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {
+                    "id": span.id,
+                    "parent_id": span.parent_id,
+                    **span.attributes,
+                    **span.counters,
+                },
+            }
+            for span in spans
+        ]
+        trace = {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"started_at": self.started_at, "dropped_spans": dropped},
+        }
+        _write_atomically(path, json.dumps(trace, default=str))
+
+    def write_metrics(self, path):
+        """
+        Writes the totals per span name as a Prometheus textfile.
+        """
+        stats = self.stats()
+        lines = []
+
+        def add_gauge(name: str, help_text: str, samples: list[tuple[str, float]]):
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(f"{metric}{labels} {value}" for labels, value in samples)
+
+        add_gauge(
+            "stage_seconds",
+            "Seconds spent in the spans of the stage during the last run.",
+            [(_labels(stage=name), totals["seconds"]) for name, totals in stats.items()],
+        )
+        add_gauge(
+            "stage_max_seconds",
+            "Seconds of the slowest span of the stage during the last run.",
+            [(_labels(stage=name), totals["max_seconds"]) for name, totals in stats.items()],
+        )
+        add_gauge(
+            "stage_spans",
+            "Spans of the stage during the last run.",
+            [(_labels(stage=name), totals["spans"]) for name, totals in stats.items()],
+        )
+        add_gauge(
+            "stage_errors",
+            "Spans of the stage which raised during the last run.",
+            [(_labels(stage=name), totals["errors"]) for name, totals in stats.items()],
+        )
+        add_gauge(
+            "stage_counter",
+            "Counters of the stage summed up over the last run, e.g. bytes or events.",
+            [
+                (_labels(stage=name, counter=counter), value)
+                for name, totals in stats.items()
+                for counter, value in sorted(totals["counters"].items())
+            ],
+        )
+        add_gauge(
+            "last_run_timestamp_seconds",
+            "Unix time the last run ended.",
+            [("", time.time())],
+        )
+        add_gauge(
+            "last_run_seconds",
+            "Seconds the last run took.",
+            [("", self.run_seconds)],
+        )
+        _write_atomically(path, "\n".join(lines) + "\n")
+
+    def export(self, trace_file=None, metrics_file=None):
+        """
+        Writes the trace and the metrics of the run, if their files are given, and starts a new run.
+        """
+        for path, write in ((trace_file, self.write_trace), (metrics_file, self.write_metrics)):
+            if not path:
+                continue
+            try:
+                write(path)
+            except Exception as e:
+                logger.warning("Failed to write %s: %s", path, e)
+        # the seconds of concurrent spans add up, they may exceed the run
+        logger.info(
+            "Busiest stages, secs: %s",
+            {
+                name: round(totals["seconds"], 2)
+                for name, totals in sorted(
+                    self.stats().items(), key=lambda item: -item[1]["seconds"]
+                )[:5]
+            },
+        )
+        self.reset()
+
+
+_tracer: Tracer | None = None
+
+
+def get_tracer() -> Tracer:
+    """
+    Returns the tracer of the process.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """
+    Times the block as a span of the tracer of the process, see Tracer.span.
+    """
+    return get_tracer().span(name, **attributes)
+
+
+def count(name: str, value: float = 1):
+    """
+    Adds the value to a counter of the current span, if there is one.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.count(name, value)
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomically(path, content: str):
+    # the textfile collector may read the file at any time
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_text(content)
+    os.replace(temp_path, path)